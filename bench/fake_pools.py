@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+"""Local stand-in for the hiveon and suprnova APIs, for load testing the pool exporter.
+
+Serves, for any wallet / coin / API key:
+  /hiveon/stats/miner/<wallet>/<coin>[/workers|/billing-acc]                   (base_url /hiveon)
+  /suprnova/<coin>/index.php?page=api&api_key=<key>&action=<action>          (base_url /suprnova/{coin})
+
+Every account gets --workers workers and --history rewards / payouts / transactions.  Hashrates and share counts
+change every --update_interval seconds, a new reward appears every --reward_interval seconds.  Responses are delayed
+by --latency seconds (+/- --jitter) and fail with a 5xx (--error_rate) or a 401 (--unauthorized_rate) at random.
+With --etag, responses carry an ETag and matching If-None-Match requests get a 304.
+"""
+
+import argparse
+import collections
+import datetime
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakePoolSettings(NamedTuple):
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    unauthorized_rate: float = 0.0
+    workers: int = 4
+    history: int = 30
+    update_interval: float = 60
+    reward_interval: float = 3600
+    etag: bool = False
+
+
+class FakePoolServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, settings: FakePoolSettings) -> None:
+        super().__init__(address, FakePoolHandler)
+        self.settings = settings
+        self.started = time.time()
+        # route -> HTTP status -> count
+        self.requests = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def count(self, route: str, status: int) -> None:
+        with self._lock:
+            self.requests[route][status] += 1
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(sum(statuses.values()) for statuses in self.requests.values())
+
+    def start(self) -> 'FakePoolServer':
+        threading.Thread(target=self.serve_forever, name='fake-pools', daemon=True).start()
+        return self
+
+
+class FakePoolHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        settings = self.server.settings
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts[0] == 'hiveon' and len(parts) >= 5 and parts[1:3] == ['stats', 'miner']:
+            route = 'hiveon/' + ('/'.join(parts[5:]) or 'stats')
+            document = hiveon_document(self.server, parts[3], parts[4], '/'.join(parts[5:]))
+        elif parts[0] == 'suprnova' and len(parts) == 3 and parts[2] == 'index.php':
+            query = parse_qs(url.query)
+            action = query.get('action', [''])[0]
+            route = 'suprnova/' + action
+            document = suprnova_document(self.server, parts[1], query.get('api_key', [''])[0], action)
+        else:
+            route, document = 'unknown', None
+
+        delay = settings.latency + random.uniform(-settings.jitter, settings.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        roll = random.random()
+        if document is None:
+            self._respond(route, 404, b'')
+        elif roll < settings.error_rate:
+            self._respond(route, random.choice((500, 502, 503)), b'upstream error')
+        elif roll < settings.error_rate + settings.unauthorized_rate:
+            self._respond(route, 401, b'unauthorized')
+        else:
+            body = json.dumps(document).encode()
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest()) if settings.etag else None
+            if etag and self.headers.get('If-None-Match') == etag:
+                self._respond(route, 304, b'', etag)
+            else:
+                self._respond(route, 200, body, etag)
+
+    def _respond(self, route: str, status: int, body: bytes, etag: str = None) -> None:
+        self.server.count(route, status)
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        if status == 200:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def account_state(server: FakePoolServer, account: str) -> tuple:
+    """A random generator seeded per account and update, the time of the last update and the number of rewards so far."""
+    elapsed = time.time() - server.started
+    update = int(elapsed // server.settings.update_interval)
+    seed = int(hashlib.sha1('{}/{}'.format(account, update).encode()).hexdigest()[:8], 16)
+    updated = datetime.datetime.fromtimestamp(server.started + update * server.settings.update_interval, datetime.timezone.utc)
+    rewards = server.settings.history + int(elapsed // server.settings.reward_interval)
+    return random.Random(seed), updated, rewards
+
+
+def history_times(server: FakePoolServer, count: int, interval: float) -> list:
+    """Timestamps of the last ``count`` events, one every ``interval`` seconds, oldest first."""
+    start = server.started - server.settings.history * interval
+    return [datetime.datetime.fromtimestamp(start + index * interval, datetime.timezone.utc) for index in range(count - server.settings.history, count)]
+
+
+def hiveon_document(server: FakePoolServer, wallet: str, coin: str, route: str):
+    rng, updated, rewards = account_state(server, wallet + coin)
+    last_share = updated.strftime('%Y-%m-%dT%H:%M:%SZ')
+    if route == '':
+        return {'hashrate': rng.uniform(1e8, 1e9), 'sharesStatusStats': {'lastShareDt': last_share, 'validCount': rng.randint(1000, 9000),
+                                                                         'staleCount': rng.randint(0, 50)}}
+    elif route == 'workers':
+        return {'workers': {'worker{:03d}'.format(index): {'hashrate': rng.uniform(1e7, 1e8),
+                                                           'sharesStatusStats': {'lastShareDt': last_share, 'validCount': rng.randint(100, 900),
+                                                                                 'staleCount': rng.randint(0, 5)}}
+                            for index in range(server.settings.workers)}}
+    elif route == 'billing-acc':
+        interval = server.settings.reward_interval
+        return {
+            'totalUnpaid': rng.uniform(0, 1),
+            'earningStats': [{'reward': 0.01, 'timestamp': stamp.strftime('%Y-%m-%dT%H:%M:%SZ')} for stamp in history_times(server, rewards, interval)],
+            'succeedPayouts': [{'amount': 0.5, 'createdAt': stamp.strftime('%Y-%m-%dT%H:%M:%S.000Z')}
+                               for stamp in history_times(server, rewards, interval)[::10]],
+        }
+    return None
+
+
+def suprnova_document(server: FakePoolServer, coin: str, api_key: str, action: str):
+    rng, _, rewards = account_state(server, api_key + coin)
+    if action == 'getuserstatus':
+        data = {'username': 'user-{}'.format(api_key[:8]), 'hashrate': rng.uniform(1e3, 1e4),
+                'shares': {'valid': rng.randint(1000, 9000), 'invalid': rng.randint(0, 50)}}
+    elif action == 'getuserbalance':
+        data = {'confirmed': rng.uniform(0, 1), 'unconfirmed': rng.uniform(0, 0.1)}
+    elif action == 'getuserworkers':
+        data = [{'username': 'user-{}.worker{:03d}'.format(api_key[:8], index), 'hashrate': rng.uniform(100, 1000), 'shares': rng.randint(100, 900)}
+                for index in range(server.settings.workers)]
+    elif action == 'getusertransactions':
+        stamps = history_times(server, rewards, server.settings.reward_interval)
+        data = {'transactions': [{'type': 'Debit_AP' if index % 10 == 9 else 'Credit', 'amount': 0.01,
+                                  'timestamp': stamp.strftime('%Y-%m-%d %H:%M:%S')} for index, stamp in enumerate(stamps)]}
+    else:
+        return None
+    return {action: {'data': data}}
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakePoolSettings()
+    parser.add_argument('--latency', dest='latency', help='Seconds each response is delayed', default=defaults.latency, type=float)
+    parser.add_argument('--jitter', dest='jitter', help='Random +/- seconds added to --latency', default=defaults.jitter, type=float)
+    parser.add_argument('--error_rate', dest='error_rate', help='Fraction of requests failing with a 5xx', default=defaults.error_rate, type=float)
+    parser.add_argument('--unauthorized_rate', dest='unauthorized_rate', help='Fraction of requests failing with a 401',
+                        default=defaults.unauthorized_rate, type=float)
+    parser.add_argument('--workers', dest='workers', help='Workers per account', default=defaults.workers, type=int)
+    parser.add_argument('--history', dest='history', help='Rewards / transactions per account', default=defaults.history, type=int)
+    parser.add_argument('--update_interval', dest='update_interval', help='Seconds between changes of the hashrates and shares',
+                        default=defaults.update_interval, type=float)
+    parser.add_argument('--reward_interval', dest='reward_interval', help='Seconds between two rewards', default=defaults.reward_interval, type=float)
+    parser.add_argument('--etag', dest='etag', help='Send ETags and answer If-None-Match with 304', action='store_true')
+
+
+def settings_from(opts: argparse.Namespace) -> FakePoolSettings:
+    return FakePoolSettings(**{field: getattr(opts, field) for field in FakePoolSettings._fields})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fake hiveon and suprnova APIs', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p', '--port', dest='port', help='The listening port', default=18080, type=int)
+    add_arguments(parser)
+    opts = parser.parse_args()
+
+    server = FakePoolServer(('127.0.0.1', opts.port), settings_from(opts))
+    print('hiveon base_url: {}/hiveon'.format(server.url))
+    print('suprnova base_url: {}/suprnova/{{coin}}'.format(server.url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+"""Generates realistic HiveOS statistics files for a synthetic rig.
+
+Writes rig.conf, gpu-detect.json, gpu-stats.json and last_stat.json (using the miner2 / miner_stats2 / ... layout for
+every miner after the first) into a directory, in the same layout the aggregate mode of hiveos-exporter expects.
+"""
+
+import argparse
+import json
+import os
+import random
+from typing import List
+
+GPU_MODELS = (
+    ('nvidia', 'GeForce RTX 3070', ('EVGA', 'MSI', 'Gigabyte', 'ASUS')),
+    ('nvidia', 'GeForce RTX 3060 Ti', ('EVGA', 'Zotac', 'Palit')),
+    ('amd', 'Radeon RX 6800', ('Sapphire', 'PowerColor', 'XFX')),
+    ('amd', 'Radeon RX 580', ('Sapphire', 'MSI', 'ASRock')),
+)
+GPU_MINERS = (('t-rex', '0.24.8', 'ETH', 'ethash'), ('lolminer', '1.42', 'ETC', 'etchash'), ('gminer', '2.75', 'RVN', 'kawpow'))
+CPU_MINER = ('xmrig', '6.16.2', 'XMR', 'randomx')
+
+
+def gpu_detect(gpus: int, rng: random.Random) -> List[dict]:
+    cards = []
+    for index in range(gpus):
+        brand, name, vendors = rng.choice(GPU_MODELS)
+        cards.append({
+            'busid': '{:02x}:00.0'.format(index + 1),
+            'name': name,
+            'brand': brand,
+            'subvendor': rng.choice(vendors),
+            'mem': '8192 MB',
+            'vbios': '94.04.{}.00.{}'.format(rng.randint(10, 99), rng.randint(10, 99)),
+            'plim_min': '100 W',
+            'plim_def': '220 W',
+            'plim_max': '240 W',
+        })
+
+    return cards
+
+
+def gpu_stats(cards: List[dict], rng: random.Random) -> dict:
+    return {
+        'busids': [card['busid'] for card in cards],
+        'brand': [card['brand'] for card in cards],
+        'temp': [rng.randint(45, 70) for _ in cards],
+        'fan': [rng.randint(40, 90) for _ in cards],
+        'power': [rng.randint(100, 230) for _ in cards],
+        'load': [rng.randint(95, 100) for _ in cards],
+        'mtemp': [rng.randint(70, 100) if card['brand'] == 'nvidia' else 0 for card in cards],
+        'jtemp': [rng.randint(60, 90) if card['brand'] == 'amd' else 0 for card in cards],
+    }
+
+
+def miner_stats(name: str, version: str, algo: str, bus_numbers: list, rng: random.Random) -> dict:
+    hashrates = [round(rng.uniform(25000, 65000), 3) for _ in bus_numbers]
+    accepted = rng.randint(1000, 50000)
+    return {
+        'hs': hashrates,
+        'hs_units': 'khs',
+        'temp': [rng.randint(45, 70) for _ in bus_numbers],
+        'fan': [rng.randint(40, 90) for _ in bus_numbers],
+        'uptime': rng.randint(3600, 864000),
+        'ver': version,
+        'ar': [accepted, rng.randint(0, 50), rng.randint(0, 5)],
+        'algo': algo,
+        'bus_numbers': bus_numbers,
+    }
+
+
+def last_stat(cards: List[dict], stats: dict, miners: int, rng: random.Random) -> dict:
+    """Spreads the cards over the GPU miners.  With more than one miner, the last one mines on the CPU."""
+    gpu_miner_count = max(1, miners - 1)
+    bus_numbers = [int(card['busid'].split(':')[0], 16) for card in cards]
+    chunk = -(-len(bus_numbers) // gpu_miner_count) if bus_numbers else 0
+
+    params = {
+        'v': 1,
+        'rig_id': rng.randint(100000, 999999),
+        'meta': {},
+        'temp': stats['temp'],
+        'fan': stats['fan'],
+        'power': stats['power'],
+        'df': '{}G'.format(rng.randint(1, 8)),
+        'mem': [7885, rng.randint(1000, 4000)],
+        'cpuavg': [round(rng.uniform(0, 4), 2) for _ in range(3)],
+        'cputemp': [rng.randint(35, 70) for _ in range(rng.randint(1, 2))],
+    }
+    for miner_num in range(1, miners + 1):
+        postfix = '' if miner_num == 1 else str(miner_num)
+        if miners > 1 and miner_num == miners:
+            name, version, coin, algo = CPU_MINER
+            miner_bus_numbers = [None]
+            stats_blob = miner_stats(name, version, algo, miner_bus_numbers, rng)
+            stats_blob['hs'] = [round(rng.uniform(500, 1500), 3) for _ in range(rng.randint(4, 16))]
+        else:
+            name, version, coin, algo = GPU_MINERS[(miner_num - 1) % len(GPU_MINERS)]
+            if miner_num > len(GPU_MINERS):
+                name = '{}-{}'.format(name, miner_num)
+            miner_bus_numbers = bus_numbers[(miner_num - 1) * chunk:miner_num * chunk]
+            stats_blob = miner_stats(name, version, algo, miner_bus_numbers, rng)
+
+        params['meta'][name] = {'coin': coin, 'algo': algo}
+        params['miner{}'.format(postfix)] = name
+        params['miner_stats{}'.format(postfix)] = stats_blob
+        params['total_khs{}'.format(postfix)] = round(sum(stats_blob['hs']), 3)
+
+    return {'method': 'stats', 'jsonrpc': '2.0', 'id': None, 'params': params}
+
+
+def write_rig(directory: str, gpus: int, miners: int, rig_name: str = 'bench-rig', seed: int = 0) -> None:
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    cards = gpu_detect(gpus, rng)
+    stats = gpu_stats(cards, rng)
+    documents = {
+        'gpu-detect.json': cards,
+        'gpu-stats.json': stats,
+        'last_stat.json': last_stat(cards, stats, miners, rng),
+    }
+    for file_name, document in documents.items():
+        with open(os.path.join(directory, file_name), 'w') as output:
+            json.dump(document, output)
+
+    with open(os.path.join(directory, 'rig.conf'), 'w') as output:
+        output.write('HIVE_HOST_URL="http://api.hiveos.farm"\n')
+        output.write('RIG_ID={}\n'.format(rng.randint(100000, 999999)))
+        output.write('RIG_PASSWD="not-a-real-password"\n')
+        output.write('WORKER_NAME="{}"\n'.format(rig_name))
+
+
+def perturb_rig(directory: str, seed: int) -> None:
+    """Rewrites the GPU and miner values of a rig written by write_rig(), keeping its cards, miners and series."""
+    rng = random.Random(seed)
+    with open(os.path.join(directory, 'gpu-stats.json')) as source:
+        stats = json.load(source)
+    for field in ('temp', 'fan', 'power', 'mtemp', 'jtemp'):
+        stats[field] = [value + rng.randint(1, 5) if value else 0 for value in stats[field]]
+
+    with open(os.path.join(directory, 'last_stat.json')) as source:
+        document = json.load(source)
+    params = document['params']
+    for key, stats_blob in params.items():
+        if key.startswith('miner_stats'):
+            stats_blob['hs'] = [round(hs * rng.uniform(0.95, 1.05), 3) for hs in stats_blob['hs']]
+            stats_blob['ar'][0] += rng.randint(1, 20)
+            params['total_khs' + key[len('miner_stats'):]] = round(sum(stats_blob['hs']), 3)
+    params['cputemp'] = [temp + rng.randint(1, 3) for temp in params['cputemp']]
+
+    for file_name, document in (('gpu-stats.json', stats), ('last_stat.json', document)):
+        with open(os.path.join(directory, file_name), 'w') as output:
+            json.dump(document, output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Generate synthetic HiveOS statistics files', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('directory', help='Where to write the files.  With --rigs, one sub-directory per rig.')
+    parser.add_argument('-g', '--gpus', dest='gpus', help='GPUs per rig', default=8, type=int)
+    parser.add_argument('-m', '--miners', dest='miners', help='Miners per rig.  With more than one, the last is a CPU miner.', default=1, type=int)
+    parser.add_argument('-r', '--rigs', dest='rigs', help='Number of rigs to generate', default=1, type=int)
+    parser.add_argument('-s', '--seed', dest='seed', help='Random seed', default=0, type=int)
+    opts = parser.parse_args()
+
+    if opts.rigs == 1:
+        write_rig(opts.directory, opts.gpus, opts.miners, seed=opts.seed)
+        return
+
+    for index in range(opts.rigs):
+        rig_name = 'rig{:04d}'.format(index)
+        write_rig(os.path.join(opts.directory, rig_name), opts.gpus, opts.miners, rig_name=rig_name, seed=opts.seed + index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""Benchmarks the HiveOS exporter's collection cycle against synthetic fixtures.
+
+Every phase is timed over --iterations runs and then run once more under tracemalloc to measure its allocations.
+"Cold" phases start with an empty FileCache, which is what a cycle costs when HiveOS has rewritten the files.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import pathlib
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from prometheus_client import REGISTRY, generate_latest
+
+from fixtures import perturb_rig, write_rig
+
+EXPORTER_PATH = pathlib.Path(__file__).parent.parent.resolve() / 'bin' / 'hiveos-exporter.py'
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location('hiveos_exporter', EXPORTER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(phase: Callable[[], None], iterations: int, setup: Callable[[], None] = None) -> dict:
+    durations = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        phase()
+        durations.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    phase()
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations.sort()
+    return {
+        'mean_ms': statistics.mean(durations) * 1000,
+        'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+        'retained_kb': allocated / 1024,
+        'peak_kb': peak / 1024,
+    }
+
+
+def run(exporter, directory: str, iterations: int) -> dict:
+    files = exporter.RigFiles.from_directory(directory)
+    rig = exporter.read_hiveos_config(files.config)['WORKER_NAME']
+    updater = exporter.SnapshotUpdater()
+    REGISTRY.register(updater)
+
+    def cold_cache():
+        exporter.file_cache = exporter.FileCache()
+
+    seeds = iter(range(1, 1 << 30))
+
+    def new_values():
+        # HiveOS rewrote the statistics with new values for the same cards and miners.
+        perturb_rig(directory, next(seeds))
+        cold_cache()
+
+    results = {
+        'read_hiveos_config': measure(lambda: exporter.read_hiveos_config(files.config), iterations),
+        'read_gpu_details': measure(lambda: exporter.read_gpu_details(files.gpu_detect), iterations, cold_cache),
+        'read_miner_stats': measure(lambda: exporter.read_miner_stats(files.stats), iterations, cold_cache),
+        'read_gpu_stats': measure(lambda: exporter.read_gpu_stats(files.gpu_stats), iterations, cold_cache),
+        # Fresh caches and no previous snapshot: the first cycle after startup.
+        'cycle_first': measure(lambda: exporter.update_metrics(rig, exporter.SnapshotUpdater(), files), iterations, cold_cache),
+        # Every value changed, series already known: a normal cycle.
+        'cycle_changed': measure(lambda: exporter.update_metrics(rig, updater, files), iterations, new_values),
+        # Nothing changed since the previous cycle.
+        'cycle_unchanged': measure(lambda: exporter.update_metrics(rig, updater, files), iterations),
+        'exposition': measure(lambda: generate_latest(REGISTRY), iterations),
+    }
+    results['exposition']['bytes'] = len(generate_latest(REGISTRY))
+    return results
+
+
+def print_results(results: dict) -> None:
+    print('{:<20} {:>10} {:>10} {:>12} {:>10}'.format('phase', 'mean ms', 'p95 ms', 'retained KB', 'peak KB'))
+    for phase, result in results.items():
+        print('{:<20} {:>10.3f} {:>10.3f} {:>12.1f} {:>10.1f}'.format(phase, result['mean_ms'], result['p95_ms'], result['retained_kb'], result['peak_kb']))
+    print('exposition size: {} bytes'.format(results['exposition']['bytes']))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='HiveOS exporter collection cycle benchmark', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-g', '--gpus', dest='gpus', help='GPUs on the synthetic rig', default=16, type=int)
+    parser.add_argument('-m', '--miners', dest='miners', help='Miners on the synthetic rig', default=3, type=int)
+    parser.add_argument('-n', '--iterations', dest='iterations', help='Timed runs per phase', default=200, type=int)
+    parser.add_argument('-d', '--directory', dest='directory', help='Use existing HiveOS files instead of generating them', default=None)
+    parser.add_argument('--json', dest='json', help='Print the results as JSON', action='store_true')
+    opts = parser.parse_args()
+
+    exporter = load_exporter()
+    exporter.init_logging('warning')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The cycle_changed phase rewrites the statistics, so existing files are benchmarked on a copy.
+        directory = os.path.join(temp_dir, 'rig')
+        if opts.directory:
+            shutil.copytree(opts.directory, directory)
+        else:
+            write_rig(directory, opts.gpus, opts.miners)
+        results = run(exporter, directory, opts.iterations)
+
+    if opts.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""Load tests the pool exporter against the fake hiveon and suprnova APIs of fake_pools.py.
+
+Runs a PoolCollector with --hiveon wallets and --suprnova API keys pointed at the fake APIs, scrapes it every
+--scrape_interval seconds for --duration seconds, and reports the scrape latency percentiles, the number of upstream
+requests per scrape and how much the process grew.  The fake APIs run in-process unless --url points at a separate
+fake_pools.py.
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import pathlib
+import resource
+import statistics
+import sys
+import time
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from fake_pools import FakePoolServer, add_arguments, settings_from
+
+EXPORTER_PATH = pathlib.Path(__file__).parent.parent.resolve() / 'bin' / 'pool-exporter.py'
+
+
+def load_exporter():
+    spec = importlib.util.spec_from_file_location('pool_exporter', EXPORTER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def pool_config(url: str, hiveon: int, suprnova: int, refresh: float) -> dict:
+    config = {}
+    if hiveon:
+        config['hiveon'] = [{'wallet': '0x{:040x}'.format(index), 'coin': 'ETH', 'base_url': url + '/hiveon', 'refresh_interval': refresh}
+                            for index in range(hiveon)]
+    if suprnova:
+        config['suprnova'] = [{'api_key': '{:064x}'.format(index), 'coin': 'rtm', 'base_url': url + '/suprnova/{coin}', 'refresh_interval': refresh}
+                              for index in range(suprnova)]
+    return config
+
+
+def max_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(exporter, config: dict, opts: argparse.Namespace, server: FakePoolServer = None) -> dict:
+    registry = CollectorRegistry()
+    collector = exporter.PoolCollector(config, refresh_rate=opts.refresh, max_workers=opts.pool_workers, deadline=opts.deadline)
+    registry.register(collector)
+    collector.start()
+
+    # Let the first round of refreshes finish before measuring.
+    time.sleep(opts.warmup)
+    gc.collect()
+    rss_start = max_rss_kb()
+    requests_start = server.total_requests() if server else None
+
+    durations = []
+    sizes = []
+    end = time.monotonic() + opts.duration
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        exposition = generate_latest(registry)
+        durations.append(time.perf_counter() - start)
+        sizes.append(len(exposition))
+        time.sleep(opts.scrape_interval)
+
+    collector.stop()
+    gc.collect()
+    durations.sort()
+    results = {
+        'scrapes': len(durations),
+        'scrape_mean_ms': statistics.mean(durations) * 1000,
+        'scrape_p50_ms': percentile(durations, 0.5) * 1000,
+        'scrape_p90_ms': percentile(durations, 0.9) * 1000,
+        'scrape_p99_ms': percentile(durations, 0.99) * 1000,
+        'exposition_bytes': sizes[-1],
+        'pools_with_data': sum(1 for cur_pool in collector._pools.values() if cur_pool.snapshot is not None),
+        'pools_stale': sum(1 for cur_pool in collector._pools.values() if cur_pool.breaker.state != cur_pool.breaker.CLOSED),
+        'max_rss_start_kb': rss_start,
+        'max_rss_end_kb': max_rss_kb(),
+        'max_rss_growth_kb': max_rss_kb() - rss_start,
+    }
+    if server:
+        upstream = server.total_requests() - requests_start
+        results['upstream_requests'] = upstream
+        results['upstream_requests_per_scrape'] = upstream / len(durations)
+        results['upstream_statuses'] = {route: dict(statuses) for route, statuses in sorted(server.requests.items())}
+    return results
+
+
+def print_results(results: dict) -> None:
+    for key, value in results.items():
+        if key == 'upstream_statuses':
+            for route, statuses in value.items():
+                print('{:<32} {}'.format(route, ', '.join('{}: {}'.format(status, count) for status, count in sorted(statuses.items()))))
+        elif isinstance(value, float):
+            print('{:<32} {:.3f}'.format(key, value))
+        else:
+            print('{:<32} {}'.format(key, value))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Pool exporter load test', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--hiveon', dest='hiveon', help='Number of hiveon wallets', default=100, type=int)
+    parser.add_argument('--suprnova', dest='suprnova', help='Number of suprnova API keys', default=100, type=int)
+    parser.add_argument('--url', dest='url', help='Use the fake APIs of a running fake_pools.py instead of starting them', default=None)
+    parser.add_argument('-r', '--refresh', dest='refresh', help='Pool refresh interval in seconds', default=5, type=float)
+    parser.add_argument('-w', '--pool_workers', dest='pool_workers', help='Pools refreshed concurrently', default=8, type=int)
+    parser.add_argument('--deadline', dest='deadline', help='Deadline of a round of refreshes in seconds', default=60, type=float)
+    parser.add_argument('--warmup', dest='warmup', help='Seconds to wait for the first refreshes before scraping', default=5, type=float)
+    parser.add_argument('-d', '--duration', dest='duration', help='Seconds to scrape for', default=30, type=float)
+    parser.add_argument('-i', '--scrape_interval', dest='scrape_interval', help='Seconds between scrapes', default=0.5, type=float)
+    parser.add_argument('--json', dest='json', help='Print the results as JSON', action='store_true')
+    add_arguments(parser)
+    opts = parser.parse_args()
+
+    server = None
+    url = opts.url
+    if not url:
+        server = FakePoolServer(('127.0.0.1', 0), settings_from(opts)).start()
+        url = server.url
+
+    exporter = load_exporter()
+    exporter.init_logging('critical')
+    results = run(exporter, pool_config(url, opts.hiveon, opts.suprnova, opts.refresh), opts, server)
+    if opts.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
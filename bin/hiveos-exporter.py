@@ -1,38 +1,287 @@
 #!/usr/bin/python3
 
 import argparse
+import concurrent.futures
 import datetime
 import json
 import logging
+import math
+import os
+import pathlib
 import re
 import sys
-from time import sleep
-from typing import List, Tuple
-
-from prometheus_client import Gauge, start_http_server
+import tempfile
+import threading
+from array import array
+from time import monotonic, sleep, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple, Union
+
+from prometheus_client import REGISTRY
+
+# JSON decoders that can be selected with --json_backend.  orjson is optional and much faster when it is installed.
+JSON_BACKENDS = {'json': json.loads}
+try:
+    import orjson
+    JSON_BACKENDS['orjson'] = orjson.loads
+except ImportError:
+    pass
+from prometheus_client.core import GaugeMetricFamily
+
+sys.path.append('{}/../'.format(pathlib.Path(__file__).parent.resolve()))
+from exporter import instrumentation  # noqa: E402
+from exporter.exposition import ExpositionCache, start_http_server  # noqa: E402
 
 HIVEOS_CONFIG = '/hive-config/rig.conf'
 HIVEOS_GPU_DETECT_FILE = '/run/hive/gpu-detect.json'
 HIVEOS_STATS_FILE = '/run/hive/last_stat.json'
 GPU_STATS_FILE = '/run/hive/gpu-stats.json'
 
+# The name of each file inside a rig directory when aggregating many rigs (see RigAggregator).
+RIG_FILE_NAMES = tuple(os.path.basename(path) for path in (HIVEOS_CONFIG, HIVEOS_GPU_DETECT_FILE, HIVEOS_STATS_FILE, GPU_STATS_FILE))
+VALID_RIG_NAME = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]*$')
+MAX_INGEST_BYTES = 16 * 1024 * 1024
+
+# The only parts of last_stat.json the exporter uses.  Everything else (and every other field of the miner stats) is
+# dropped right after decoding, so it is never kept around in the FileCache.
+STATS_PARAMS = ('meta', 'cputemp')
+MINER_STATS_FIELDS = ('ver', 'ar', 'hs', 'bus_numbers')
+
 SENSITIVE_CONFIG = ('RIG_PASSWD',)
 GPU_LABELS = ['rig', 'card', 'model', 'brand', 'vendor']
-METRICS = {
-    'gpu_fan': Gauge('hiveos_gpu_fan', 'GPU Fan Speed', GPU_LABELS),
-    'gpu_coretemp': Gauge('hiveos_gpu_core_temp', 'GPU Core Temp', GPU_LABELS),
-    'gpu_hash': Gauge('hiveos_gpu_hashrate', 'GPU Hashrate', GPU_LABELS + ['coin', 'miner', 'miner_version']),
-    'gpu_jtemp': Gauge('hiveos_gpu_junction_temp', 'GPU Junction Temperature', GPU_LABELS),
-    'gpu_load': Gauge('hiveos_gpu_load', 'GPU load utilization', GPU_LABELS),
-    'gpu_memtemp': Gauge('hiveos_gpu_mem_temp', 'GPU Memory Temperature', GPU_LABELS),
-    'gpu_power': Gauge('hiveos_gpu_power_watts', 'GPU Power Consumption', GPU_LABELS),
-    'cpu_hash': Gauge('hiveos_cpu_hashrate', 'CPU Hashrate', ['rig', 'core', 'coin', 'miner', 'miner_version']),
-    'cpu_temp': Gauge('hiveos_cpu_temp', 'CPU Temperature', ['rig', 'cpu']),
-    'ratio': Gauge('hiveos_miner_ratio', 'Acceptance ratio', ['rig', 'type', 'coin', 'miner', 'miner_version']),
-    'total_hash': Gauge('hiveos_miner_hashrate', 'Hashrate', ['rig', 'coin', 'miner', 'miner_version']),
+# gpu-stats.json field -> metric key of its rolling window statistics (see GpuTelemetry)
+GPU_WINDOW_FIELDS = {
+    'temp': 'gpu_coretemp_window',
+    'mtemp': 'gpu_memtemp_window',
+    'jtemp': 'gpu_jtemp_window',
+    'power': 'gpu_power_window',
+    'fan': 'gpu_fan_window',
+    'load': 'gpu_load_window',
+}
+WINDOW_STATS = ('min', 'max', 'avg', 'p95')
+# metric key -> (name, documentation, labels)
+METRIC_DEFINITIONS = {
+    'gpu_info': ('hiveos_gpu_info', 'GPU identity, always 1', GPU_LABELS),
+    'gpu_fan': ('hiveos_gpu_fan', 'GPU Fan Speed', GPU_LABELS),
+    'gpu_coretemp': ('hiveos_gpu_core_temp', 'GPU Core Temp', GPU_LABELS),
+    'gpu_hash': ('hiveos_gpu_hashrate', 'GPU Hashrate', GPU_LABELS + ['coin', 'miner', 'miner_version']),
+    'gpu_jtemp': ('hiveos_gpu_junction_temp', 'GPU Junction Temperature', GPU_LABELS),
+    'gpu_load': ('hiveos_gpu_load', 'GPU load utilization', GPU_LABELS),
+    'gpu_memtemp': ('hiveos_gpu_mem_temp', 'GPU Memory Temperature', GPU_LABELS),
+    'gpu_power': ('hiveos_gpu_power_watts', 'GPU Power Consumption', GPU_LABELS),
+    'gpu_coretemp_window': ('hiveos_gpu_core_temp_window', 'GPU Core Temp over the --sample_window', GPU_LABELS + ['stat']),
+    'gpu_memtemp_window': ('hiveos_gpu_mem_temp_window', 'GPU Memory Temperature over the --sample_window', GPU_LABELS + ['stat']),
+    'gpu_jtemp_window': ('hiveos_gpu_junction_temp_window', 'GPU Junction Temperature over the --sample_window', GPU_LABELS + ['stat']),
+    'gpu_power_window': ('hiveos_gpu_power_watts_window', 'GPU Power Consumption over the --sample_window', GPU_LABELS + ['stat']),
+    'gpu_fan_window': ('hiveos_gpu_fan_window', 'GPU Fan Speed over the --sample_window', GPU_LABELS + ['stat']),
+    'gpu_load_window': ('hiveos_gpu_load_window', 'GPU load utilization over the --sample_window', GPU_LABELS + ['stat']),
+    'cpu_hash': ('hiveos_cpu_hashrate', 'CPU Hashrate', ['rig', 'core', 'coin', 'miner', 'miner_version']),
+    'cpu_temp': ('hiveos_cpu_temp', 'CPU Temperature', ['rig', 'cpu']),
+    'ratio': ('hiveos_miner_ratio', 'Acceptance ratio', ['rig', 'type', 'coin', 'miner', 'miner_version']),
+    'total_hash': ('hiveos_miner_hashrate', 'Hashrate', ['rig', 'coin', 'miner', 'miner_version']),
 }
 
 log = None
+json_loads = JSON_BACKENDS.get('orjson', json.loads)
+# metric key -> relabel function (None if the labels are unchanged) for every exported metric, once --label_config is
+# applied.  None when there is no label config.
+relabelers = None
+
+
+class RigFiles(NamedTuple):
+    config: str
+    gpu_detect: str
+    stats: str
+    gpu_stats: str
+
+    @classmethod
+    def from_directory(cls, directory: str) -> 'RigFiles':
+        return cls(*(os.path.join(directory, name) for name in RIG_FILE_NAMES))
+
+
+def local_rig_files() -> RigFiles:
+    return RigFiles(HIVEOS_CONFIG, HIVEOS_GPU_DETECT_FILE, HIVEOS_STATS_FILE, GPU_STATS_FILE)
+
+
+class FileCache:
+    """Caches the parsed contents of files, only re-parsing a file when it has changed on disk.
+
+    A file is considered changed when its inode, size or modification time differs from when it was last parsed.  That
+    costs a single stat() per lookup, so unchanged files (e.g. gpu-detect.json) are never re-read and a file that is
+    looked up more than once per cycle (e.g. last_stat.json) is only parsed once.
+
+    Reads and parses are timed as the read and parse phases, prefixed with phase_prefix.
+    """
+
+    def __init__(self, phase_prefix: str = '') -> None:
+        self._entries = {}
+        self._read_phase = phase_prefix + 'read'
+        self._parse_phase = phase_prefix + 'parse'
+
+    def load(self, path: str, parser: Callable[[bytes], Any] = None) -> Any:
+        parser = parser or json_loads
+        with instrumentation.phase('hiveos', self._read_phase):
+            stat = os.stat(path)
+            signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            cached = self._entries.get((path, parser))
+            if cached and cached[0] == signature:
+                return cached[1]
+
+            with open(path, 'rb') as file:
+                content = file.read()
+
+        with instrumentation.phase('hiveos', self._parse_phase):
+            parsed = parser(content)
+        self._entries[(path, parser)] = (signature, parsed)
+        return parsed
+
+
+file_cache = FileCache()
+
+
+class GpuTelemetry:
+    """Rolling window of gpu-stats.json samples, taken far more often than the metrics are refreshed.
+
+    Every GPU_WINDOW_FIELDS field of every card has a fixed-size ring buffer of 32 bit floats holding the last
+    window / interval samples, so spikes between two refreshes show up in the min / max / avg / p95 of the window.
+    Empty slots and the zero memory / junction temperatures of cards that do not report them are NaN and ignored.
+    """
+
+    def __init__(self, window: float, interval: float) -> None:
+        self._interval = interval
+        self._capacity = max(1, round(window / interval))
+        self._lock = threading.Lock()
+        # field -> one ring buffer per card.  All buffers share the write position.
+        self._buffers = {}
+        self._cards = 0
+        self._position = 0
+        # Samples are read far more often than the refresh cycle reads its files, so they are timed as phases of their
+        # own (sample_read, sample_parse) rather than drowning out the cost of the cycle.
+        self._files = FileCache(phase_prefix='sample_')
+
+    def run(self, path: str = None) -> None:
+        path = path or GPU_STATS_FILE
+        while True:
+            try:
+                self.record(self._files.load(path))
+            except Exception as e:
+                log.debug('Unable to sample the GPU statistics -> %s', str(e))
+            sleep(self._interval)
+
+    def record(self, gpu_stats: dict) -> None:
+        cards = len(gpu_stats['temp'])
+        with self._lock:
+            if cards != self._cards:
+                # Cards were added or removed, so the old samples can no longer be attributed to a card.
+                self._buffers = {field: [array('f', [math.nan]) * self._capacity for _ in range(cards)] for field in GPU_WINDOW_FIELDS}
+                self._cards = cards
+                self._position = 0
+
+            for field, buffers in self._buffers.items():
+                values = gpu_stats.get(field)
+                for index, buffer in enumerate(buffers):
+                    value = float(values[index]) if values else math.nan
+                    buffer[self._position] = value if value > 0 or field not in ('mtemp', 'jtemp') else math.nan
+            self._position = (self._position + 1) % self._capacity
+
+    def summary(self) -> dict:
+        """field -> for every card, its WINDOW_STATS over the window or None when it has no samples of that field."""
+        with self._lock:
+            buffers = {field: [buffer.tolist() for buffer in card_buffers] for field, card_buffers in self._buffers.items()}
+
+        summary = {}
+        for field, card_buffers in buffers.items():
+            summary[field] = []
+            for samples in card_buffers:
+                samples = sorted(value for value in samples if not math.isnan(value))
+                if not samples:
+                    summary[field].append(None)
+                    continue
+                p95 = samples[math.ceil(len(samples) * 0.95) - 1]
+                summary[field].append((samples[0], samples[-1], sum(samples) / len(samples), p95))
+        return summary
+
+
+class MetricSnapshot(NamedTuple):
+    """One complete cycle of metric families.  Never modified once published."""
+    generation: int
+    timestamp: float
+    families: Tuple[GaugeMetricFamily, ...]
+
+
+class SnapshotUpdater:
+    """Builds each cycle off to the side and publishes it as a new MetricSnapshot with a single reference swap.
+
+    Scrapes read ``snapshot`` once and serialize it, so they always see the values of one complete cycle and never
+    wait on the refresh loop.  Only the families of metrics with a changed, added or removed series are rebuilt, the
+    others are shared with the previous snapshot.  Cycles that changed nothing keep the current snapshot, so its
+    generation only changes along with the data.
+
+    Every series remembers the cycle it was last written in.  Series that have not been written for stale_cycles
+    cycles (a stopped miner, an upgraded miner_version, a removed card, ...) are dropped.
+    """
+
+    @property
+    def snapshot(self) -> MetricSnapshot:
+        return self._snapshot
+
+    def __init__(self, stale_cycles: int = 1) -> None:
+        # 0 would drop the series written in the very cycle that is being published.
+        if stale_cycles < 1:
+            raise ValueError('stale_cycles must be at least 1, not {}'.format(stale_cycles))
+        self._stale_cycles = stale_cycles
+        self._cycle = 0
+        # metric key -> label values -> [value, last cycle written]
+        self._series = {key: {} for key in METRIC_DEFINITIONS}
+        # Metric keys whose family has to be rebuilt for the next snapshot.
+        self._dirty = set(METRIC_DEFINITIONS)
+        self._families = {}
+        self._snapshot = MetricSnapshot(0, time(), ())
+
+    def start_cycle(self) -> None:
+        self._cycle += 1
+
+    def finish_cycle(self) -> None:
+        oldest = self._cycle - self._stale_cycles
+        for metric, series in self._series.items():
+            stale = [label_values for label_values, (_, cycle) in series.items() if cycle <= oldest]
+            for label_values in stale:
+                log.info('Removing stale %s series %s', metric, label_values)
+                del series[label_values]
+            if stale:
+                self._dirty.add(metric)
+
+        if not self._dirty:
+            return
+
+        for metric in self._dirty:
+            name, documentation, labels = METRIC_DEFINITIONS[metric]
+            family = GaugeMetricFamily(name, documentation, labels=labels)
+            for label_values, (value, _) in self._series[metric].items():
+                family.add_metric([str(label) for label in label_values], value)
+            self._families[metric] = family
+        self._dirty = set()
+        # The only write scrapes can observe.
+        self._snapshot = MetricSnapshot(self._snapshot.generation + 1, time(), tuple(self._families[key] for key in METRIC_DEFINITIONS))
+
+    def set(self, metric: str, label_values: tuple, value: float) -> None:
+        series = self._series[metric]
+        current = series.get(label_values)
+        if current is None:
+            series[label_values] = [value, self._cycle]
+            self._dirty.add(metric)
+            return
+
+        current[1] = self._cycle
+        if current[0] != value:
+            current[0] = value
+            self._dirty.add(metric)
+
+    def collect(self):
+        yield from self._snapshot.families
+
+    def describe(self) -> List:
+        return []
 
 
 class Gpu:
@@ -43,6 +292,8 @@ class Gpu:
         self.bus_number_hex_str = gpu_detect_dict['busid']
         self.bus_number_decimal = int(gpu_detect_dict['busid'].split(':')[0], 16)
         self.card_index = index
+        # Label values in GPU_LABELS order (minus the rig), built once per gpu-detect.json change.
+        self.labels = (self.card_index, self.model, self.brand, self.vendor)
 
     def is_nvidia(self) -> bool:
         return self.brand.lower() == 'nvidia'
@@ -57,6 +308,7 @@ class Miner:
         self.stats = stats
         self.total_hs = total_khs * 1000
         self.coin = coin
+        self.version = stats['ver']
 
     def is_gpu_miner(self) -> bool:
         return self.stats['bus_numbers'][0] is not None
@@ -65,28 +317,335 @@ class Miner:
         return self.stats['bus_numbers'][0] is None
 
 
-def read_gpu_details() -> Tuple[List[Gpu], dict]:
+class MetricFamilyBuilder:
+    """Collects the values written by update_metrics() into fresh GaugeMetricFamily objects on every cycle."""
+
+    @property
+    def families(self) -> List[GaugeMetricFamily]:
+        return list(self._families.values())
+
+    def __init__(self) -> None:
+        self._families = {}
+
+    def start_cycle(self) -> None:
+        self._families = {
+            key: GaugeMetricFamily(name, documentation, labels=labels) for key, (name, documentation, labels) in METRIC_DEFINITIONS.items()
+        }
+
+    def finish_cycle(self) -> None:
+        pass
+
+    def set(self, metric: str, label_values: tuple, value: float) -> None:
+        self._families[metric].add_metric([str(label) for label in label_values], value)
+
+
+class SampleRecorder:
+    """Records the values written by update_metrics() as plain (metric key, label values, value) tuples."""
+
+    def __init__(self) -> None:
+        self.samples = []
+
+    def start_cycle(self) -> None:
+        self.samples = []
+
+    def finish_cycle(self) -> None:
+        pass
+
+    def set(self, metric: str, label_values: tuple, value: float) -> None:
+        self.samples.append((metric, label_values, value))
+
+
+class RigCollector:
+    """Reads the HiveOS files when Prometheus scrapes instead of on a fixed refresh loop.
+
+    Scrapes arriving within min_interval seconds of the last read (e.g. from an HA pair of Prometheus servers) share
+    that read.  Nothing is read while nobody is scraping.
+    """
+
+    def __init__(self, rig: str, min_interval: float, telemetry: GpuTelemetry = None) -> None:
+        self._rig = rig
+        self._min_interval = min_interval
+        self._telemetry = telemetry
+        self._lock = threading.Lock()
+        self._families = []
+        self._last_read = None
+
+    def collect(self):
+        with self._lock:
+            now = monotonic()
+            if self._last_read is None or now - self._last_read >= self._min_interval:
+                builder = MetricFamilyBuilder()
+                try:
+                    update_metrics(self._rig, relabeled(builder), telemetry=self._telemetry)
+                    self._families = builder.families
+                except Exception:
+                    log.exception('Failed to read HiveOS statistics.  Serving the previous values.')
+                self._last_read = now
+            families = self._families
+
+        yield from families
+
+    def describe(self) -> List:
+        return []
+
+
+class RigAggregator:
+    """Serves the statistics of many rigs from a single exporter.
+
+    Every sub-directory of ``directory`` holds one rig's rig.conf, gpu-detect.json, last_stat.json and gpu-stats.json,
+    either synced there from the rigs or uploaded through the IngestHandler.  On each refresh only the rigs whose files
+    changed are re-read, spread over a pool of worker processes.  The samples of all rigs are then published as one new
+    set of metric families.
+
+    Rigs whose last successfully read files are older than max_age seconds (a rig that stopped syncing, or whose files
+    no longer parse) are no longer exported until they are updated again.
+    """
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever the samples of a rig changed or a rig was removed or expired."""
+        return self._generation
+
+    def __init__(self, directory: str, executor: concurrent.futures.Executor, max_age: float = 300) -> None:
+        self._directory = directory
+        self._executor = executor
+        self._max_age = max_age
+        self._generation = 0
+        # rig directory -> (file signatures, rig name, samples, modification time of the newest file)
+        self._rigs = {}
+        # Rig directories that are not exported because their statistics are older than max_age.
+        self._expired = set()
+        self._families = []
+
+    def refresh(self) -> None:
+        futures = {}
+        present = set()
+        for entry in os.scandir(self._directory):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+
+            files = RigFiles.from_directory(entry.path)
+            try:
+                signature = tuple((stat.st_ino, stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, files))
+            except FileNotFoundError:
+                log.debug('Skipping incomplete rig directory %s', entry.path)
+                continue
+
+            present.add(entry.path)
+            if entry.path not in self._rigs or self._rigs[entry.path][0] != signature:
+                futures[self._executor.submit(read_rig, entry.path)] = (entry.path, signature)
+
+        for future in concurrent.futures.as_completed(futures):
+            rig_dir, signature = futures[future]
+            try:
+                self._rigs[rig_dir] = (signature,) + future.result() + (max(stat[2] for stat in signature) / 1e9,)
+            except Exception:
+                log.exception('Failed to read the statistics of the rig in %s', rig_dir)
+
+        removed = set(self._rigs) - present
+        for rig_dir in removed:
+            log.info('Rig directory %s was removed.  No longer exporting its statistics.', rig_dir)
+            del self._rigs[rig_dir]
+
+        expired = set()
+        if self._max_age:
+            now = time()
+            expired = {rig_dir for rig_dir, rig in self._rigs.items() if now - rig[3] > self._max_age}
+        for rig_dir in expired - self._expired:
+            log.warning('The statistics of the rig in %s are older than %s seconds.  No longer exporting them.', rig_dir, self._max_age)
+        for rig_dir in self._expired - expired - removed:
+            log.info('The statistics of the rig in %s were updated.  Exporting them again.', rig_dir)
+        expiry_changed = expired != self._expired
+        self._expired = expired
+
+        if not futures and not removed and not expiry_changed and self._families:
+            return
+
+        # Workers always record the full label values, the label rules are applied here.
+        builder = MetricFamilyBuilder()
+        updater = relabeled(builder)
+        updater.start_cycle()
+        # Rigs are labelled with their WORKER_NAME.  Two directories holding the same rig would export every series
+        # twice and Prometheus would reject the whole scrape, so only the first directory of a rig is exported.
+        exported = {}
+        for rig_dir in sorted(self._rigs):
+            if rig_dir in expired:
+                continue
+            _, rig, samples, _ = self._rigs[rig_dir]
+            if rig in exported:
+                log.warning('Rig %s in %s is already exported from %s.  Skipping it.', rig, rig_dir, exported[rig])
+                continue
+            exported[rig] = rig_dir
+            for metric, label_values, value in samples:
+                updater.set(metric, label_values, value)
+        updater.finish_cycle()
+        self._families = builder.families
+        self._generation += 1
+
+    def collect(self):
+        yield from self._families
+
+    def describe(self) -> List:
+        return []
+
+
+class RelabelingUpdater:
+    """Applies the --label_config rules to the values written by update_metrics() before passing them on.
+
+    Values of denied metrics are discarded.  Series that end up with the same label values once labels were dropped
+    are only written once per cycle.
+    """
+
+    def __init__(self, updater: 'Updater', metric_relabelers: dict) -> None:
+        self._updater = updater
+        self._relabelers = metric_relabelers
+        self._written = set()
+
+    def start_cycle(self) -> None:
+        self._written = set()
+        self._updater.start_cycle()
+
+    def finish_cycle(self) -> None:
+        self._updater.finish_cycle()
+
+    def set(self, metric: str, label_values: tuple, value: float) -> None:
+        if metric not in self._relabelers:
+            return
+
+        relabel = self._relabelers[metric]
+        if relabel:
+            label_values = relabel(label_values)
+            if (metric, label_values) in self._written:
+                return
+            self._written.add((metric, label_values))
+        self._updater.set(metric, label_values, value)
+
+
+Updater = Union[SnapshotUpdater, MetricFamilyBuilder, SampleRecorder, RelabelingUpdater]
+
+
+def relabeled(updater: Updater) -> Updater:
+    return RelabelingUpdater(updater, relabelers) if relabelers is not None else updater
+
+
+def apply_label_rules(rules) -> None:
+    """Redefines METRIC_DEFINITIONS with the labels kept by ``rules`` (an exporter.relabel.LabelRules) and drops denied metrics."""
+    global relabelers
+    relabelers = {}
+    for key, (name, documentation, labels) in list(METRIC_DEFINITIONS.items()):
+        if not rules.allowed(name):
+            del METRIC_DEFINITIONS[key]
+            continue
+
+        kept = rules.labels(name, labels)
+        METRIC_DEFINITIONS[key] = (name, documentation, kept)
+        relabelers[key] = rules.relabeler(name, labels)
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    """Accepts ``PUT /ingest/<rig>/<file>`` uploads of a rig's HiveOS files into the aggregator's directory."""
+
+    directory = None
+
+    def do_PUT(self) -> None:
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 3 or parts[0] != 'ingest' or not VALID_RIG_NAME.match(parts[1]) or parts[2] not in RIG_FILE_NAMES:
+            self.send_error(404)
+            return
+
+        if 'Content-Length' not in self.headers:
+            self.send_error(411)
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            length = -1
+        if length <= 0:
+            self.send_error(400, 'Invalid Content-Length')
+            return
+        if length > MAX_INGEST_BYTES:
+            self.send_error(413)
+            return
+
+        body = self.rfile.read(length)
+        if len(body) != length:
+            self.send_error(400, 'Incomplete upload')
+            return
+
+        rig_dir = os.path.join(self.directory, parts[1])
+        os.makedirs(rig_dir, exist_ok=True)
+        # Write to a hidden file of its own first, so the aggregator never reads a partially uploaded file and concurrent
+        # uploads of the same file never write to the same temporary file.
+        fd, temp_path = tempfile.mkstemp(prefix='.{}.'.format(parts[2]), suffix='.tmp', dir=rig_dir)
+        try:
+            with os.fdopen(fd, 'wb') as upload:
+                upload.write(body)
+            os.replace(temp_path, os.path.join(rig_dir, parts[2]))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args) -> None:
+        log.debug('Ingest %s - %s', self.address_string(), format % args)
+
+
+def read_rig(directory: str) -> Tuple[str, List[Tuple[str, tuple, float]]]:
+    """The rig name and the samples of the rig whose HiveOS files are in ``directory``."""
+    files = RigFiles.from_directory(directory)
+    config = read_hiveos_config(files.config)
+    rig = config.get('WORKER_NAME', os.path.basename(directory))
+    recorder = SampleRecorder()
+    update_metrics(rig, recorder, files)
+    return rig, recorder.samples
+
+
+def parse_gpu_details(gpu_detect: bytes) -> Tuple[List[Gpu], dict]:
     gpu_by_index = []
     gpu_by_bus_num = {}
-    log.debug('Reading GPU details from %s', HIVEOS_GPU_DETECT_FILE)
-    with open(HIVEOS_GPU_DETECT_FILE, 'r') as gpu_detect:
-        for index, cur_gpu in enumerate(json.load(gpu_detect)):
-            gpu_obj = Gpu(index, cur_gpu)
-            gpu_by_index.append(gpu_obj)
-            gpu_by_bus_num[gpu_obj.bus_number_decimal] = gpu_obj
+    for index, cur_gpu in enumerate(json_loads(gpu_detect)):
+        gpu_obj = Gpu(index, cur_gpu)
+        gpu_by_index.append(gpu_obj)
+        gpu_by_bus_num[gpu_obj.bus_number_decimal] = gpu_obj
 
     return gpu_by_index, gpu_by_bus_num
 
 
-def read_stats_file() -> dict:
-    log.debug('Reading statistics from %s', HIVEOS_STATS_FILE)
-    with open(HIVEOS_STATS_FILE, 'r') as stats:
-        return json.load(stats)
+def read_gpu_details(path: str = None) -> Tuple[List[Gpu], dict]:
+    path = path or HIVEOS_GPU_DETECT_FILE
+    log.debug('Reading GPU details from %s', path)
+    return file_cache.load(path, parse_gpu_details)
+
 
+def parse_stats(stats: bytes) -> dict:
+    params = json_loads(stats)['params']
+    selected = {key: params[key] for key in STATS_PARAMS if key in params}
+    for miner_num in range(1, len(params.get('meta', {})) + 1):
+        postfix = ''
+        if miner_num > 1:
+            postfix = str(miner_num)
 
-def read_miner_stats() -> List[Miner]:
+        if 'miner{}'.format(postfix) not in params:
+            continue
+        miner_stats = params['miner_stats{}'.format(postfix)]
+        selected['miner{}'.format(postfix)] = params['miner{}'.format(postfix)]
+        selected['miner_stats{}'.format(postfix)] = {field: miner_stats[field] for field in MINER_STATS_FIELDS if field in miner_stats}
+        selected['total_khs{}'.format(postfix)] = params['total_khs{}'.format(postfix)]
+
+    return {'params': selected}
+
+
+def read_stats_file(path: str = None) -> dict:
+    path = path or HIVEOS_STATS_FILE
+    log.debug('Reading statistics from %s', path)
+    return file_cache.load(path, parse_stats)
+
+
+def read_miner_stats(path: str = None) -> List[Miner]:
     miners = []
-    data = read_stats_file()['params']
+    data = read_stats_file(path)['params']
     for miner_name, meta in data['meta'].items():
         for miner_num in range(1, len(data['meta']) + 1):
             postfix = ''
@@ -105,14 +664,14 @@ def read_miner_stats() -> List[Miner]:
     return miners
 
 
-def read_cpu_temp() -> List:
-    return read_stats_file()['params']['cputemp']
+def read_cpu_temp(path: str = None) -> List:
+    return read_stats_file(path)['params']['cputemp']
 
 
-def read_gpu_stats() -> dict:
-    log.debug('Reading GPU statistics from %s', GPU_STATS_FILE)
-    with open(GPU_STATS_FILE, 'r') as gpu_stats:
-        return json.load(gpu_stats)
+def read_gpu_stats(path: str = None) -> dict:
+    path = path or GPU_STATS_FILE
+    log.debug('Reading GPU statistics from %s', path)
+    return file_cache.load(path)
 
 
 def read_hiveos_config(path: str) -> dict:
@@ -131,6 +690,71 @@ def read_hiveos_config(path: str) -> dict:
     return config
 
 
+def update_metrics(rig: str, updater: 'Updater', files: RigFiles = None, telemetry: GpuTelemetry = None) -> None:
+    files = files or local_rig_files()
+    gpu_by_index, gpu_by_bus_num = read_gpu_details(files.gpu_detect)
+    miners = read_miner_stats(files.stats)
+    gpu_stats = read_gpu_stats(files.gpu_stats)
+    cpu_temps = read_cpu_temp(files.stats)
+    gpu_window = telemetry.summary() if telemetry else None
+
+    with instrumentation.phase('hiveos', 'update'):
+        write_metrics(rig, updater, gpu_by_index, gpu_by_bus_num, miners, gpu_stats, cpu_temps, gpu_window)
+
+
+def write_metrics(rig: str, updater: 'Updater', gpu_by_index: List[Gpu], gpu_by_bus_num: dict, miners: List[Miner], gpu_stats: dict,
+                  cpu_temps: List, gpu_window: dict = None) -> None:
+    updater.start_cycle()
+    for cur_miner in miners:
+        miner_labels = (cur_miner.coin, cur_miner.name, cur_miner.version)
+        updater.set('ratio', (rig, 'accepted') + miner_labels, cur_miner.stats['ar'][0])
+        updater.set('ratio', (rig, 'rejected') + miner_labels, cur_miner.stats['ar'][1])
+        if len(cur_miner.stats['ar']) >= 3:
+            updater.set('ratio', (rig, 'invalid') + miner_labels, cur_miner.stats['ar'][2])
+        else:
+            log.debug('Miner %s does not support tracking invalid shares', cur_miner.name)
+
+        updater.set('total_hash', (rig,) + miner_labels, cur_miner.total_hs)
+        if cur_miner.is_gpu_miner():
+            for index, bus_number in enumerate(cur_miner.stats['bus_numbers']):
+                try:
+                    cur_gpu = gpu_by_bus_num[bus_number]
+                    updater.set('gpu_hash', (rig,) + cur_gpu.labels + miner_labels, cur_miner.stats['hs'][index])
+                except KeyError:
+                    log.warning('Device detected with invalid bus number.  Assuming this is a non-GPU device')
+                    updater.set('gpu_hash', (rig, index, 'unknown', 'unknown', 'unknown') + miner_labels, cur_miner.stats['hs'][index])
+
+        elif cur_miner.is_cpu_miner():
+            for index, hs in enumerate(cur_miner.stats['hs']):
+                updater.set('cpu_hash', (rig, index) + miner_labels, hs)
+
+    for index, cur_gpu in enumerate(gpu_by_index):
+        labels = (rig,) + cur_gpu.labels
+        updater.set('gpu_info', labels, 1)
+        updater.set('gpu_coretemp', labels, gpu_stats['temp'][index])
+        updater.set('gpu_power', labels, gpu_stats['power'][index])
+        updater.set('gpu_fan', labels, gpu_stats['fan'][index])
+        updater.set('gpu_load', labels, gpu_stats['load'][index])
+
+        # Not all cards support tracking memory/junction temps.
+        if 'mtemp' in gpu_stats and int(gpu_stats['mtemp'][index]) > 0:
+            updater.set('gpu_memtemp', labels, gpu_stats['mtemp'][index])
+        if 'jtemp' in gpu_stats and int(gpu_stats['jtemp'][index]) > 0:
+            updater.set('gpu_jtemp', labels, gpu_stats['jtemp'][index])
+
+        if gpu_window:
+            for field, metric in GPU_WINDOW_FIELDS.items():
+                card_window = gpu_window[field]
+                if index < len(card_window) and card_window[index]:
+                    for stat, value in zip(WINDOW_STATS, card_window[index]):
+                        updater.set(metric, labels + (stat,), value)
+
+    for index, cur_temp in enumerate(cpu_temps):
+        updater.set('cpu_temp', (rig, index), cur_temp)
+
+    updater.finish_cycle()
+
+
 def init_logging(level):
     global log
     log = logging.getLogger(__name__)
@@ -144,74 +768,180 @@ def init_logging(level):
     log.setLevel(log_level_constant)
 
 
-def get_opts():
+def init_worker(level, json_backend):
+    # Forked workers inherit the configured logger and backend.  Spawned workers start from a fresh interpreter.
+    global json_loads
+    if log is None:
+        init_logging(level)
+    json_loads = JSON_BACKENDS[json_backend]
+
+
+def get_opts(args: List[str] = None):
     parser = argparse.ArgumentParser(description='HiveOS Prometheus exporter', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-l', '--log_level', dest='log_level', help='The logging level', default='info')
     parser.add_argument('-r', '--refresh', dest='refresh', help='How often to refresh metrics', default=60, type=int)
     parser.add_argument('-p', '--port', dest='port', help='The listening port for the exporter', default=10101, type=int)
-    return parser.parse_args()
+    parser.add_argument('-s', '--stale_cycles', dest='stale_cycles', default=1, type=int,
+                        help='Remove series that have not been updated for this many refreshes.  Must be at least 1.')
+    parser.add_argument('-j', '--json_backend', dest='json_backend', choices=sorted(JSON_BACKENDS),
+                        default='orjson' if 'orjson' in JSON_BACKENDS else 'json', help='The JSON decoder used to read the HiveOS files')
+    parser.add_argument('--self_metrics', dest='self_metrics', action='store_true',
+                        help="Export exporter_* metrics about the exporter's own performance")
+    parser.add_argument('-m', '--mode', dest='mode', choices=('loop', 'scrape', 'aggregate', 'push'), default='loop',
+                        help='Refresh metrics every --refresh seconds (loop), read them when Prometheus scrapes (scrape), '
+                             'serve every rig found under --rigs_dir (aggregate), or push them every --refresh seconds to --push_url (push)')
+    parser.add_argument('-i', '--min_interval', dest='min_interval', default=10, type=float,
+                        help='In scrape mode, the minimum number of seconds between two reads of the HiveOS statistics')
+    parser.add_argument('-d', '--rigs_dir', dest='rigs_dir', default='/var/lib/hiveos-exporter/rigs',
+                        help='In aggregate mode, the directory holding one sub-directory of HiveOS files per rig')
+    parser.add_argument('-w', '--workers', dest='workers', default=os.cpu_count(), type=int,
+                        help='In aggregate mode, the number of processes used to parse rig statistics')
+    parser.add_argument('--push_url', dest='push_url', default=None,
+                        help='In push mode, the base URL of the Pushgateway or the URL of the remote write endpoint')
+    parser.add_argument('--push_format', dest='push_format', choices=('pushgateway', 'remote_write'), default='pushgateway',
+                        help='In push mode, the protocol spoken by --push_url.  remote_write requires python-snappy.')
+    parser.add_argument('--push_job', dest='push_job', default='hiveos', help='In push mode, the job label of the pushed metrics')
+    parser.add_argument('--spool_dir', dest='spool_dir', default='/var/spool/hiveos-exporter',
+                        help='In push mode, where batches are kept until they have been pushed')
+    parser.add_argument('--spool_size', dest='spool_size', default=64, type=int,
+                        help='In push mode, the maximum size of the spooled batches in MB.  The oldest batches are dropped first.')
+    parser.add_argument('--sample_interval', dest='sample_interval', default=0, type=float,
+                        help='Seconds between two samples of gpu-stats.json for the *_window metrics.  0 disables sampling.')
+    parser.add_argument('--sample_window', dest='sample_window', default=60, type=float,
+                        help='Seconds of GPU samples summarized by the *_window metrics')
+    parser.add_argument('--label_config', dest='label_config', default=None,
+                        help='YAML file of metrics to allow / deny and labels to drop / rewrite (see etc/labels.yml)')
+    parser.add_argument('--exposition_max_age', dest='exposition_max_age', default=15, type=float,
+                        help='Seconds a rendered /metrics response is served to scrapers while the statistics are unchanged')
+    parser.add_argument('--rig_max_age', dest='rig_max_age', default=300, type=float,
+                        help='In aggregate mode, stop exporting rigs whose statistics were last updated this many seconds ago.  '
+                             '0 exports them until their directory is removed.')
+    parser.add_argument('--ingest_port', dest='ingest_port', default=None, type=int,
+                        help='In aggregate mode, also accept PUT /ingest/<rig>/<file> uploads on this port')
+    parser.add_argument('--ingest_address', dest='ingest_address', default='127.0.0.1',
+                        help='The address --ingest_port listens on.  The uploads are not authenticated, only listen on trusted networks.')
+    opts = parser.parse_args(args)
+    if opts.stale_cycles < 1:
+        parser.error('--stale_cycles must be at least 1')
+    return opts
+
+
+def run_aggregator(opts) -> None:
+    os.makedirs(opts.rigs_dir, exist_ok=True)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=opts.workers, initializer=init_worker,
+                                                   initargs=(opts.log_level, opts.json_backend))
+    aggregator = RigAggregator(opts.rigs_dir, executor, max_age=opts.rig_max_age)
+    REGISTRY.register(aggregator)
+
+    if opts.ingest_port:
+        IngestHandler.directory = opts.rigs_dir
+        ingest_server = ThreadingHTTPServer((opts.ingest_address, opts.ingest_port), IngestHandler)
+        log.info('Accepting rig uploads on %s port %s', opts.ingest_address, opts.ingest_port)
+        threading.Thread(target=ingest_server.serve_forever, name='ingest', daemon=True).start()
+
+    log.info('Starting HTTP server on port %s', opts.port)
+    start_http_server(opts.port, ExpositionCache(generation=lambda: aggregator.generation, max_age=opts.exposition_max_age))
+    while True:
+        aggregator.refresh()
+        sleep(opts.refresh)
+
+
+def start_telemetry(opts) -> Optional[GpuTelemetry]:
+    if not opts.sample_interval:
+        return None
+
+    telemetry = GpuTelemetry(opts.sample_window, opts.sample_interval)
+    threading.Thread(target=telemetry.run, name='gpu-sampler', daemon=True).start()
+    log.info('Sampling GPU statistics every %s seconds over a %s second window', opts.sample_interval, opts.sample_window)
+    return telemetry
+
+
+def run_pusher(opts, rig: str, telemetry: GpuTelemetry = None) -> None:
+    # Only push mode needs requests (and optionally snappy).
+    from exporter.push import Pusher, PushgatewayTarget, RemoteWriteTarget, Spool
+
+    if not opts.push_url:
+        log.error('--push_url is required in push mode')
+        sys.exit(1)
+
+    target_class = RemoteWriteTarget if opts.push_format == 'remote_write' else PushgatewayTarget
+    target = target_class(opts.push_url, opts.push_job, rig)
+    # Batches are encoded for a specific target, so every format gets its own spool.
+    pusher = Pusher(target, Spool(os.path.join(opts.spool_dir, target.name), max_bytes=opts.spool_size * 1024 * 1024))
+    builder = MetricFamilyBuilder()
+    updater = relabeled(builder)
+    log.info('Pushing metrics to %s every %s seconds', opts.push_url, opts.refresh)
+    while True:
+        collected_at = time()
+        update_metrics(rig, updater, telemetry=telemetry)
+        with instrumentation.phase('hiveos', 'push'):
+            pusher.push(builder.families, collected_at)
+        sleep(opts.refresh)
+
+
+def configure(opts) -> None:
+    global json_loads
+    json_loads = JSON_BACKENDS[opts.json_backend]
+    if opts.self_metrics:
+        instrumentation.enable()
+    if opts.label_config:
+        # Only needed (along with PyYAML) when a label config is used.
+        from exporter.relabel import LabelRules
+        apply_label_rules(LabelRules.load(opts.label_config))
+
+
+class LocalRig(NamedTuple):
+    """How the metrics of the local rig are served: the generation and max age of their ExpositionCache and, in loop
+    mode, the refresh loop the caller has to run."""
+    generation: Optional[Callable[[], Any]]
+    max_age: float
+    refresh_loop: Optional[Callable[[], None]]
+
+
+def start_local_rig(opts, rig: str, telemetry: GpuTelemetry = None) -> LocalRig:
+    """Sets up the collection of the local rig's metrics in loop or scrape mode."""
+    if opts.mode == 'scrape':
+        REGISTRY.register(RigCollector(rig, opts.min_interval, telemetry))
+        # The statistics are re-read at most every --min_interval seconds, so renders are cached for as long.
+        return LocalRig(None, opts.min_interval, None)
+
+    snapshot_updater = SnapshotUpdater(stale_cycles=opts.stale_cycles)
+    REGISTRY.register(snapshot_updater)
+    updater = relabeled(snapshot_updater)
+
+    def refresh_loop() -> None:
+        while True:
+            update_metrics(rig, updater, telemetry=telemetry)
+
+            next_check = datetime.datetime.now() + datetime.timedelta(seconds=opts.refresh)
+            log.info('Next metric refresh at %s', next_check.strftime('%Y-%d-%m %H:%M:%S'))
+            sleep(opts.refresh)
+
+    return LocalRig(lambda: snapshot_updater.snapshot.generation, opts.exposition_max_age, refresh_loop)
 
 
 def main():
     opts = get_opts()
     init_logging(opts.log_level)
+    configure(opts)
+    if opts.mode == 'aggregate':
+        run_aggregator(opts)
+        return
+
     config = read_hiveos_config(HIVEOS_CONFIG)
     rig = config['WORKER_NAME']
+    telemetry = start_telemetry(opts)
+    if opts.mode == 'push':
+        run_pusher(opts, rig, telemetry)
+        return
+
+    local_rig = start_local_rig(opts, rig, telemetry)
     log.info('Starting HTTP server on port %s', opts.port)
-    start_http_server(opts.port)
+    start_http_server(opts.port, ExpositionCache(generation=local_rig.generation, max_age=local_rig.max_age))
+    if local_rig.refresh_loop:
+        local_rig.refresh_loop()
     while True:
-        gpu_by_index, gpu_by_bus_num = read_gpu_details()
-        for cur_miner in read_miner_stats():
-            METRICS['ratio'].labels(rig=rig, type='accepted', coin=cur_miner.coin,
-                                    miner=cur_miner.name, miner_version=cur_miner.stats['ver']).set(cur_miner.stats['ar'][0])
-            METRICS['ratio'].labels(rig=rig, type='rejected', coin=cur_miner.coin,
-                                    miner=cur_miner.name, miner_version=cur_miner.stats['ver']).set(cur_miner.stats['ar'][1])
-            if len(cur_miner.stats['ar']) >= 3:
-                METRICS['ratio'].labels(rig=rig, type='invalid', coin=cur_miner.coin,
-                                        miner=cur_miner.name, miner_version=cur_miner.stats['ver']).set(cur_miner.stats['ar'][2])
-            else:
-                log.debug('Miner %s does not support tracking invalid shares', cur_miner.name)
-
-            METRICS['total_hash'].labels(rig=rig, coin=cur_miner.coin, miner=cur_miner.name,
-                                         miner_version=cur_miner.stats['ver']).set(cur_miner.total_hs)
-            if cur_miner.is_gpu_miner():
-                for index, bus_number in enumerate(cur_miner.stats['bus_numbers']):
-                    try:
-                        cur_gpu = gpu_by_bus_num[bus_number]
-                        METRICS['gpu_hash'].labels(rig=rig, card=cur_gpu.card_index, model=cur_gpu.model,
-                                                   brand=cur_gpu.brand, vendor=cur_gpu.vendor, coin=cur_miner.coin,
-                                                   miner=cur_miner.name, miner_version=cur_miner.stats['ver']).set(cur_miner.stats['hs'][index])
-                    except KeyError:
-                        log.warning('Device detected with invalid bus number.  Assuming this is a non-GPU device')
-                        METRICS['gpu_hash'].labels(rig=rig, card=index, model='unknown',
-                                                   brand='unknown', vendor='unknown', coin=cur_miner.coin,
-                                                   miner=cur_miner.name, miner_version=cur_miner.stats['ver']).set(cur_miner.stats['hs'][index])
-
-            elif cur_miner.is_cpu_miner():
-                for index, hs in enumerate(cur_miner.stats['hs']):
-                    METRICS['cpu_hash'].labels(rig=rig, core=index, coin=cur_miner.coin,
-                                               miner=cur_miner.name, miner_version=cur_miner.stats['ver']).set(hs)
-
-        gpu_stats = read_gpu_stats()
-        for index, cur_gpu in enumerate(gpu_by_index):
-            labels = dict(rig=rig, card=cur_gpu.card_index, model=cur_gpu.model, brand=cur_gpu.brand, vendor=cur_gpu.vendor)
-            METRICS['gpu_coretemp'].labels(**labels).set(gpu_stats['temp'][index])
-            METRICS['gpu_power'].labels(**labels).set(gpu_stats['power'][index])
-            METRICS['gpu_fan'].labels(**labels).set(gpu_stats['fan'][index])
-            METRICS['gpu_load'].labels(**labels).set(gpu_stats['load'][index])
-
-            # Not all cards support tracking memory/junction temps.
-            if 'mtemp' in gpu_stats and int(gpu_stats['mtemp'][index]) > 0:
-                METRICS['gpu_memtemp'].labels(**labels).set(gpu_stats['mtemp'][index])
-            if 'jtemp' in gpu_stats and int(gpu_stats['jtemp'][index]) > 0:
-                METRICS['gpu_jtemp'].labels(**labels).set(gpu_stats['jtemp'][index])
-
-        for index, cur_temp in enumerate(read_cpu_temp()):
-            METRICS['cpu_temp'].labels(rig=rig, cpu=index).set(cur_temp)
-
-        next_check = datetime.datetime.now() + datetime.timedelta(seconds=opts.refresh)
-        log.info('Next metric refresh at %s', next_check.strftime('%Y-%d-%m %H:%M:%S'))
-        sleep(opts.refresh)
+        sleep(3600)
 
 
 if __name__ == '__main__':
@@ -2,16 +2,30 @@
 
 import argparse
 import importlib
+import json
 import logging
+import os
 import pathlib
+import signal
+import sqlite3
 import sys
+import time
 from time import sleep
-from typing import Generator, List
+from typing import Dict, Generator, List, Optional
 
 import yaml
-from prometheus_client import REGISTRY, Metric, start_http_server
+from prometheus_client import REGISTRY, Metric
 from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
+sys.path.append("{}/../".format(pathlib.Path(__file__).parent.resolve()))
+from exporter import instrumentation  # noqa: E402
+from exporter.exposition import ExpositionCache, start_http_server  # noqa: E402
+from exporter.relabel import LabelRules  # noqa: E402
+from pool.cache import ResponseCache  # noqa: E402
+from pool.pool import Pool  # noqa: E402
+from pool.scheduler import RefreshScheduler  # noqa: E402
+from pool.transport import Transport  # noqa: E402
+
 log = None
 
 
@@ -20,18 +34,60 @@ class PoolCollector:
     _balance_tags = ("wallet", "coin", "pool", "type")
     _ratio_tags = ("wallet", "coin", "pool", "type", "worker")
     _reward_tags = _balance_tags
-
-    _pool_list = []
-
-    def __init__(self, pool_config: dict, refresh_rate) -> None:
-        sys.path.append("{}/../".format(pathlib.Path(__file__).parent.resolve()))
+    _snapshot_tags = ("wallet", "coin", "pool")
+
+    def __init__(
+        self,
+        pool_config: dict,
+        refresh_rate,
+        max_workers: int = 8,
+        deadline: float = 60,
+        cache: ResponseCache = None,
+        transport: Transport = None,
+        label_rules: LabelRules = None,
+    ) -> None:
+        self._refresh_rate = refresh_rate
+        self._label_rules = label_rules
+        self._cache = cache
+        self._transport = transport
+        # Pool instances keyed by their configuration.  The dict is replaced, never modified, when the config is reloaded.
+        self._pools = self._build_pools(pool_config, {})
+        self._scheduler = RefreshScheduler(self._pools.values(), max_workers=max_workers, deadline=deadline)
+
+    def reload(self, pool_config: dict) -> None:
+        """Applies a new pool configuration.
+
+        Only pool instances whose configuration was added or changed are constructed.  Unchanged instances keep their
+        data and refresh schedule.  If any new instance cannot be constructed, the running configuration
+        is kept.
+        """
+        pools = self._build_pools(pool_config, self._pools)
+        removed = [cur_pool for key, cur_pool in self._pools.items() if key not in pools]
+        added = len(pools) - (len(self._pools) - len(removed))
+        self._pools = pools
+        self._scheduler.update(pools.values())
+        log.info("Reloaded pool configuration: {} added, {} removed, {} unchanged".format(added, len(removed), len(pools) - added))
+
+    def _build_pools(self, pool_config: dict, current: Dict[str, Pool]) -> Dict[str, Pool]:
+        pools = {}
         for pool_name, instances in pool_config.items():
-            module = importlib.import_module("pool.{}".format(pool_name))
-            klass = getattr(module, pool_name)
+            klass = None
             for cur_instance in instances:
+                cur_instance = dict(cur_instance)
                 if "refresh_interval" not in cur_instance:
-                    cur_instance["refresh_interval"] = refresh_rate
-                self._pool_list.append(klass(**cur_instance))
+                    cur_instance["refresh_interval"] = self._refresh_rate
+
+                key = "{}:{}".format(pool_name, json.dumps(cur_instance, sort_keys=True))
+                if key in current:
+                    pools[key] = current[key]
+                    continue
+
+                if klass is None:
+                    module = importlib.import_module("pool.{}".format(pool_name))
+                    klass = getattr(module, pool_name)
+                pools[key] = klass(cache=self._cache, transport=self._transport, **cur_instance)
+
+        return pools
 
     # def _gen_metric_familes(self):
     #     hashrate = GaugeMetricFamily(name="pool_hashrate", documentation="Pool hashrate in H/s", labels=self._hashrate_tags)
@@ -40,6 +96,16 @@ class PoolCollector:
     #     reward = GaugeMetricFamily(name="pool_reward", documentation="Rewards from pool", labels=self._reward_tags)
     #     return hashrate, balance, ratio, reward
 
+    @property
+    def generation(self) -> int:
+        return self._scheduler.generation
+
+    def start(self) -> None:
+        self._scheduler.start()
+
+    def stop(self) -> None:
+        self._scheduler.stop()
+
     def collect(self):
         log.info("Collecting pool metrics")
         # hashrate, balance, ratio, reward = self._gen_metric_familes()
@@ -47,45 +113,71 @@ class PoolCollector:
         balance = CounterMetricFamily(name="pool_balance", documentation="Pool coin balance", labels=self._balance_tags)
         ratio = CounterMetricFamily(name="pool_ratio", documentation="Share acceptance counters", labels=self._ratio_tags)
         reward = GaugeMetricFamily(name="pool_reward", documentation="Rewards from pool", labels=self._reward_tags)
-
-        for cur_pool in self._pool_list:
-            log.debug('Collecting metrics for pool "{}"'.format(cur_pool.__class__.__name__))
-
-            # Default pool hashrate / ratio metrics
-            pool_hashrate, hashrate_timestamp = cur_pool.pool_hashrate
-            hashrate.add_metric(value=pool_hashrate, timestamp=hashrate_timestamp, labels=[cur_pool.wallet, cur_pool.coin, cur_pool.pool, "total"])
-            for ratio_type, ratio_value, timestamp in cur_pool.pool_ratio:
-                ratio.add_metric(value=ratio_value, timestamp=timestamp, labels=[cur_pool.wallet, cur_pool.coin, cur_pool.pool, ratio_type, "total"])
-
-            # Default worker hashrate / ratio metrics
-            for worker_name, worker_hashrate, worker_hashrate_timestamp in cur_pool.worker_hashrates:
-                hashrate.add_metric(
-                    value=worker_hashrate, timestamp=worker_hashrate_timestamp, labels=[cur_pool.wallet, cur_pool.coin, cur_pool.pool, worker_name]
-                )
-
-            for worker_name, ratio_type, ratio_value, timestamp in cur_pool.worker_ratios:
-                ratio.add_metric(
-                    value=ratio_value, timestamp=timestamp, labels=[cur_pool.wallet, cur_pool.coin, cur_pool.pool, ratio_type, worker_name]
-                )
-
-            # Default pool balance metrics
-            pool_balance, balance_timestamp = cur_pool.pool_balance
-            balance.add_metric(value=pool_balance, timestamp=balance_timestamp, labels=[cur_pool.wallet, cur_pool.coin, cur_pool.pool, "unpaid"])
-
-            # Default pool reward metrics
-            for pool_reward, pool_reward_timestamp in cur_pool.pool_rewards:
-                reward.add_metric(
-                    value=pool_reward, timestamp=pool_reward_timestamp, labels=[cur_pool.wallet, cur_pool.coin, cur_pool.pool, "reward"]
-                )
-
-            # Default pool payout metrics
-            for pool_payout, pool_payout_timestamp in cur_pool.pool_payouts:
-                reward.add_metric(value=pool_payout, timestamp=pool_payout_timestamp, labels=[cur_pool.wallet, cur_pool.coin, cur_pool.pool, "payout"])
-
-        yield hashrate
-        yield balance
-        yield ratio
-        yield reward
+        reward_total = CounterMetricFamily(
+            name="pool_reward_amount", documentation="Cumulative rewards / payouts seen since the exporter started", labels=self._reward_tags
+        )
+        reward_last = GaugeMetricFamily(
+            name="pool_reward_last_timestamp_seconds", documentation="Time of the newest reward / payout", labels=self._reward_tags
+        )
+        # A timestamp rather than an age, so that the output only changes when the data does and can be cached.
+        refreshed = GaugeMetricFamily(
+            name="pool_snapshot_timestamp_seconds", documentation="Time the pool data was last refreshed", labels=self._snapshot_tags
+        )
+        stale = GaugeMetricFamily(
+            name="pool_snapshot_stale", documentation="1 if the last refresh of the pool failed and old data is being served", labels=self._snapshot_tags
+        )
+        failures = GaugeMetricFamily(
+            name="pool_refresh_consecutive_failures", documentation="Number of consecutive failed pool refreshes", labels=self._snapshot_tags
+        )
+
+        # Pools are refreshed in the background by the scheduler.  Only the last good snapshot of each pool is serialized here.
+        for cur_pool in self._pools.values():
+            snapshot = cur_pool.snapshot
+            if snapshot is None:
+                log.debug('No data has been collected yet for pool "{}"'.format(cur_pool.__class__.__name__))
+                continue
+
+            try:
+                with instrumentation.pool_phase(snapshot.pool, snapshot.coin, "collect"):
+                    log.debug('Collecting metrics for pool "{}"'.format(cur_pool.__class__.__name__))
+                    pool_labels = [snapshot.wallet, snapshot.coin, snapshot.pool]
+                    refreshed.add_metric(value=snapshot.timestamp, labels=pool_labels)
+                    stale.add_metric(value=int(cur_pool.breaker.state != cur_pool.breaker.CLOSED), labels=pool_labels)
+                    failures.add_metric(value=cur_pool.breaker.failures, labels=pool_labels)
+
+                    # Default pool hashrate / ratio metrics
+                    pool_hashrate, hashrate_timestamp = snapshot.pool_hashrate
+                    hashrate.add_metric(value=pool_hashrate, timestamp=hashrate_timestamp, labels=pool_labels + ["total"])
+                    for ratio_type, ratio_value, timestamp in snapshot.pool_ratio:
+                        ratio.add_metric(value=ratio_value, timestamp=timestamp, labels=pool_labels + [ratio_type, "total"])
+
+                    # Default worker hashrate / ratio metrics
+                    for worker_name, worker_hashrate, worker_hashrate_timestamp in snapshot.worker_hashrates:
+                        hashrate.add_metric(value=worker_hashrate, timestamp=worker_hashrate_timestamp, labels=pool_labels + [worker_name])
+
+                    for worker_name, ratio_type, ratio_value, timestamp in snapshot.worker_ratios:
+                        ratio.add_metric(value=ratio_value, timestamp=timestamp, labels=pool_labels + [ratio_type, worker_name])
+
+                    # Default pool balance metrics
+                    pool_balance, balance_timestamp = snapshot.pool_balance
+                    balance.add_metric(value=pool_balance, timestamp=balance_timestamp, labels=pool_labels + ["unpaid"])
+
+                    # Default pool reward / payout metrics.  Only the newest event is exported as a sample, the rest of the history
+                    # is accumulated into the totals.  Events are usually hours old, so the sample is not given the event's
+                    # timestamp (Prometheus would reject it as out of bounds), that is pool_reward_last_timestamp_seconds.
+                    for reward_type, (total, last_amount, last_timestamp) in (("reward", snapshot.pool_rewards), ("payout", snapshot.pool_payouts)):
+                        reward_total.add_metric(value=total, labels=pool_labels + [reward_type])
+                        if last_timestamp is not None:
+                            reward.add_metric(value=last_amount, labels=pool_labels + [reward_type])
+                            reward_last.add_metric(value=last_timestamp, labels=pool_labels + [reward_type])
+            except Exception:
+                # Never let a single pool take the metrics of every other pool down with it.
+                log.exception('Failed to collect metrics for pool "{}"'.format(cur_pool.__class__.__name__))
+
+        families = [hashrate, balance, ratio, reward, reward_total, reward_last, refreshed, stale, failures]
+        if self._label_rules:
+            families = self._label_rules.filter(families)
+        yield from families
 
     # def collect(self) -> Generator[Metric, None, None]:
     #     log.info("Collecting pool metrics")
@@ -113,7 +205,64 @@ def get_config(path) -> dict:
     return config
 
 
-def get_opts() -> argparse.Namespace:
+def config_signature(path) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def reload_config(collector: PoolCollector, path) -> None:
+    try:
+        config = get_config(path)
+    except (OSError, yaml.YAMLError) as e:
+        log.error("Unable to read {}.  Keeping the current pools -> {}".format(path, str(e)))
+        return
+
+    if not config:
+        log.warning("No pools are configured in {}.  Keeping the current pools.".format(path))
+        return
+
+    try:
+        collector.reload(config)
+    except Exception:
+        log.exception("Unable to apply the pool configuration in {}.  Keeping the current pools.".format(path))
+
+
+def watch_config(collector: PoolCollector, path, interval: float) -> None:
+    """Reloads the configuration on SIGHUP and, with a non-zero interval, whenever the file changes."""
+    reload_requested = []
+    signal.signal(signal.SIGHUP, lambda *_: reload_requested.append(True))
+
+    signature = config_signature(path)
+    last_check = time.monotonic()
+    while True:
+        sleep(1)
+        if interval and time.monotonic() - last_check >= interval:
+            last_check = time.monotonic()
+            if config_signature(path) != signature:
+                log.info("{} changed".format(path))
+                reload_requested.append(True)
+
+        if reload_requested:
+            reload_requested.clear()
+            signature = config_signature(path)
+            reload_config(collector, path)
+
+
+def open_cache(path: str, size_mb: int) -> ResponseCache:
+    try:
+        # A bare file name lives in the working directory, which already exists.
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return ResponseCache(path, max_bytes=size_mb * 1024 * 1024)
+    except (OSError, sqlite3.Error) as e:
+        log.warning("Unable to open the response cache {}, falling back to an in-memory cache -> {}".format(path, str(e)))
+        return ResponseCache(max_bytes=size_mb * 1024 * 1024)
+
+
+def get_opts(args: List[str] = None) -> argparse.Namespace:
     default_config_path = "{}/../etc/pools.yml".format(pathlib.Path(__file__).parent.resolve())
 
     parser = argparse.ArgumentParser(description="HiveOS Prometheus exporter", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -126,8 +275,70 @@ def get_opts() -> argparse.Namespace:
         dest="refresh",
         help="The default Pool API refresh rate.  Has no effect if refresh rate is configured via configuration file.",
         default=55,
+        type=int,
+    )
+    parser.add_argument("-w", "--workers", dest="workers", help="Maximum number of pools refreshed concurrently", default=8, type=int)
+    parser.add_argument(
+        "-d",
+        "--deadline",
+        dest="deadline",
+        help="Maximum seconds to wait for a round of pool refreshes.  Pools that miss it keep serving their last good data.",
+        default=60,
+        type=float,
+    )
+    parser.add_argument(
+        "--cache_file",
+        dest="cache_file",
+        help="SQLite file caching pool API responses across restarts.  Use :memory: to not persist the cache.",
+        default="/var/cache/hiveos-exporter/pools.sqlite",
+    )
+    parser.add_argument("--cache_size", dest="cache_size", help="Maximum size of the cached pool API responses in MB", default=16, type=int)
+    parser.add_argument(
+        "--host_connections", dest="host_connections", help="HTTP connections kept alive per pool API host", default=4, type=int
+    )
+    parser.add_argument(
+        "--host_concurrency", dest="host_concurrency", help="Maximum concurrent requests per pool API host", default=4, type=int
+    )
+    parser.add_argument(
+        "--connect_timeout", dest="connect_timeout", help="Seconds to wait for a connection to a pool API", default=5, type=float
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--retries",
+        dest="retries",
+        help="Retries of pool API requests that failed with a connection error, timeout, HTTP 429 or 5xx",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--disable_keep_alive",
+        dest="keep_alive",
+        help="Close the connection to the pool API after every request instead of keeping it alive",
+        action="store_false",
+    )
+    parser.add_argument(
+        "--retry_backoff", dest="retry_backoff", help="Upper bound in seconds of the jittered delay before the first retry", default=1, type=float
+    )
+    parser.add_argument(
+        "--exposition_max_age",
+        dest="exposition_max_age",
+        help="Seconds a rendered /metrics response is served to scrapers while the pool data is unchanged",
+        default=15,
+        type=float,
+    )
+    parser.add_argument(
+        "--label_config", dest="label_config", help="YAML file of metrics to allow / deny and labels to drop / rewrite (see etc/labels.yml)"
+    )
+    parser.add_argument(
+        "--watch_config",
+        dest="watch_config",
+        help="Seconds between checks of the config file for changes.  0 only reloads the config on SIGHUP.",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "--self_metrics", dest="self_metrics", help="Export exporter_* metrics about the exporter's own performance", action="store_true"
+    )
+    return parser.parse_args(args)
 
 
 def init_logging(level) -> None:
@@ -144,20 +355,46 @@ def init_logging(level) -> None:
         logging.getLogger(cur_logger).setLevel(log_level_constant)
 
 
-def main() -> None:
-    opts = get_opts()
-    init_logging(opts.log_level)
+def start_collector(opts: argparse.Namespace) -> PoolCollector:
+    """Builds the PoolCollector configured by ``opts``, starts refreshing the pools and registers it."""
     config = get_config(opts.config)
     if not config:
         log.error("No pools are configured for monitoring.  Quitting.")
         sys.exit(1)
 
-    log.info("Starting HTTP server on port {}".format(opts.port))
-    start_http_server(opts.port)
+    if opts.self_metrics:
+        instrumentation.enable()
 
-    REGISTRY.register(PoolCollector(config, refresh_rate=opts.refresh))
-    while True:
-        sleep(3600)
+    transport = Transport(
+        pool_size=opts.host_connections,
+        max_concurrency=opts.host_concurrency,
+        connect_timeout=opts.connect_timeout,
+        retries=opts.retries,
+        retry_backoff=opts.retry_backoff,
+        keep_alive=opts.keep_alive,
+    )
+    collector = PoolCollector(
+        config,
+        refresh_rate=opts.refresh,
+        max_workers=opts.workers,
+        deadline=opts.deadline,
+        cache=open_cache(opts.cache_file, opts.cache_size),
+        transport=transport,
+        label_rules=LabelRules.load(opts.label_config) if opts.label_config else None,
+    )
+    collector.start()
+    REGISTRY.register(collector)
+    return collector
+
+
+def main() -> None:
+    opts = get_opts()
+    init_logging(opts.log_level)
+    collector = start_collector(opts)
+
+    log.info("Starting HTTP server on port {}".format(opts.port))
+    start_http_server(opts.port, ExpositionCache(generation=lambda: collector.generation, max_age=opts.exposition_max_age))
+    watch_config(collector, opts.config, opts.watch_config)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+"""Serves the HiveOS metrics of the local rig and the pool metrics from a single process on a single port.
+
+The HiveOS and pool exporters are loaded from bin/hiveos-exporter.py and bin/pool-exporter.py only when they are
+enabled in the configuration (see etc/exporter.yml), so a disabled exporter is never imported.
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import pathlib
+import sys
+import threading
+from time import sleep
+from typing import Any, Callable, List
+
+import yaml
+
+sys.path.append("{}/../".format(pathlib.Path(__file__).parent.resolve()))
+from exporter.exposition import ExpositionCache, start_http_server  # noqa: E402
+
+BIN_DIR = pathlib.Path(__file__).parent.resolve()
+# Keys of the hiveos and pools sections read by the unified exporter itself.  Every other key is an option of that
+# exporter, named after the dest of its command line flag.  The shared options apply to both exporters.
+SECTION_OPTIONS = ("enabled",)
+SHARED_OPTIONS = ("log_level", "self_metrics", "label_config")
+
+log = None
+
+
+def load_exporter(file_name: str, module_name: str):
+    spec = importlib.util.spec_from_file_location(module_name, BIN_DIR / file_name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def exporter_opts(module, section: dict, shared: dict) -> argparse.Namespace:
+    """The options of an exporter: its command line defaults, overridden by the shared options and then its section."""
+    opts = module.get_opts([])
+    for key, value in dict(shared, **section).items():
+        if key in SECTION_OPTIONS:
+            continue
+        if not hasattr(opts, key):
+            raise ValueError("Unknown option {} for {}".format(key, module.__name__))
+        setattr(opts, key, value)
+    return opts
+
+
+def run_or_exit(target: Callable[[], None], name: str) -> None:
+    # Like the separate exporters, a crashed refresh loop takes the process down so that systemd restarts it.
+    try:
+        target()
+    except Exception:
+        log.exception("The {} refresh loop failed.  Quitting.".format(name))
+        os._exit(1)
+
+
+def start_hiveos(section: dict, shared: dict) -> tuple:
+    hiveos = load_exporter("hiveos-exporter.py", "hiveos_exporter")
+    opts = exporter_opts(hiveos, section, shared)
+    if opts.mode not in ("loop", "scrape"):
+        raise ValueError("The hiveos mode must be loop or scrape, not {}".format(opts.mode))
+
+    hiveos.init_logging(opts.log_level)
+    hiveos.configure(opts)
+    rig = hiveos.read_hiveos_config(hiveos.HIVEOS_CONFIG)["WORKER_NAME"]
+    local_rig = hiveos.start_local_rig(opts, rig, hiveos.start_telemetry(opts))
+    if local_rig.refresh_loop:
+        threading.Thread(target=run_or_exit, args=(local_rig.refresh_loop, "hiveos"), name="hiveos-refresh", daemon=True).start()
+    log.info("Serving the HiveOS metrics of rig {} in {} mode".format(rig, opts.mode))
+    return local_rig.generation, local_rig.max_age
+
+
+def start_pools(section: dict, shared: dict) -> tuple:
+    pools = load_exporter("pool-exporter.py", "pool_exporter")
+    opts = exporter_opts(pools, section, shared)
+    pools.init_logging(opts.log_level)
+    collector = pools.start_collector(opts)
+    log.info("Serving the pool metrics configured in {}".format(opts.config))
+    return pools, collector, opts
+
+
+def combined_generation(generations: List[Callable[[], Any]]) -> Callable[[], tuple]:
+    return lambda: tuple(generation() for generation in generations)
+
+
+def get_config(path) -> dict:
+    with open(path, "r") as config_file:
+        config = yaml.safe_load(config_file)
+
+    if not config:
+        config = {}
+    return config
+
+
+def get_opts() -> argparse.Namespace:
+    default_config_path = "{}/../etc/exporter.yml".format(BIN_DIR)
+
+    parser = argparse.ArgumentParser(description="HiveOS and pool Prometheus exporter", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-c", "--config", dest="config", help="Path to the config file", default=default_config_path)
+    return parser.parse_args()
+
+
+def init_logging(level) -> None:
+    global log
+    log = logging.getLogger(__name__)
+    log.addHandler(logging.NullHandler())
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+    log.addHandler(console_handler)
+    log.setLevel(getattr(logging, level.upper()))
+
+
+def main() -> None:
+    opts = get_opts()
+    config = get_config(opts.config)
+    init_logging(config.get("log_level", "info"))
+    shared = {key: config[key] for key in SHARED_OPTIONS if key in config}
+    # A section enables its exporter unless it sets enabled: false.
+    hiveos_section = config.get("hiveos")
+    pools_section = config.get("pools")
+
+    generations = []
+    max_ages = []
+    pools = None
+    try:
+        if hiveos_section is not None and hiveos_section.get("enabled", True):
+            generation, max_age = start_hiveos(hiveos_section, shared)
+            if generation:
+                generations.append(generation)
+            max_ages.append(max_age)
+
+        if pools_section is not None and pools_section.get("enabled", True):
+            pools, collector, pool_opts = start_pools(pools_section, shared)
+            generations.append(lambda: collector.generation)
+            max_ages.append(pool_opts.exposition_max_age)
+    except (OSError, ValueError) as e:
+        log.error("Unable to start the exporters -> {}".format(str(e)))
+        sys.exit(1)
+
+    if not max_ages:
+        log.error("Neither the hiveos nor the pools exporter is enabled in {}.  Quitting.".format(opts.config))
+        sys.exit(1)
+
+    port = config.get("port", 10100)
+    log.info("Starting HTTP server on port {}".format(port))
+    # Scrape mode has no generation, it re-reads the statistics at most every min_interval seconds instead.
+    start_http_server(port, ExpositionCache(generation=combined_generation(generations), max_age=min(max_ages)))
+    if pools:
+        pools.watch_config(collector, pool_opts.config, pool_opts.watch_config)
+    while True:
+        sleep(3600)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Serves /metrics from a cache of rendered expositions shared by every scraper.
+
+The text and OpenMetrics expositions are rendered at most once per data generation, stored both plain and gzipped,
+and served with an ETag.  Scrapes of data that has not changed since the last render (an HA pair of Prometheus
+servers, a Grafana Agent, ...) only copy the cached bytes, or get a 304 when they send a matching If-None-Match.
+
+The generation is a callable returning any value that changes whenever the collected data changes.  Metrics that
+change on their own (process_*, exporter_*) are refreshed by re-rendering entries older than max_age seconds.
+"""
+
+import gzip
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from typing import Any, Callable, NamedTuple, Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client import exposition
+from prometheus_client.openmetrics import exposition as openmetrics
+
+
+class Exposition(NamedTuple):
+    body: bytes
+    gzipped: bytes
+    etag: str
+    content_type: str
+
+
+class ExpositionCache:
+    def __init__(self, registry: CollectorRegistry = REGISTRY, generation: Callable[[], Any] = None, max_age: float = 15) -> None:
+        self._registry = registry
+        self._generation = generation or (lambda: None)
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # openmetrics flag -> (generation, monotonic() of the render, Exposition)
+        self._entries = {}
+
+    def get(self, openmetrics_format: bool = False) -> Exposition:
+        with self._lock:
+            generation = self._generation()
+            entry = self._entries.get(openmetrics_format)
+            if entry and entry[0] == generation and monotonic() - entry[1] < self._max_age:
+                return entry[2]
+
+            # Scrapers arriving while this renders wait on the lock and then share the result.
+            rendered = self._render(openmetrics_format)
+            self._entries[openmetrics_format] = (generation, monotonic(), rendered)
+            return rendered
+
+    def _render(self, openmetrics_format: bool) -> Exposition:
+        if openmetrics_format:
+            body = openmetrics.generate_latest(self._registry)
+            content_type = openmetrics.CONTENT_TYPE_LATEST
+        else:
+            body = exposition.generate_latest(self._registry)
+            content_type = exposition.CONTENT_TYPE_LATEST
+
+        # The ETag depends only on the content, so re-rendering identical data keeps it valid.  It is weak because the
+        # plain and gzipped bodies share it.
+        etag = 'W/"{}"'.format(hashlib.sha1(body).hexdigest())
+        return Exposition(body, gzip.compress(body, compresslevel=6), etag, content_type)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the exposition of ``cache`` on every path, negotiating the format and gzip like prometheus_client."""
+
+    cache = None
+
+    def do_GET(self) -> None:
+        accept = self.headers.get("Accept", "")
+        rendered = self.cache.get("application/openmetrics-text" in accept)
+        if rendered.etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+            self.send_response(304)
+            self.send_header("ETag", rendered.etag)
+            self.end_headers()
+            return
+
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = rendered.gzipped if gzipped else rendered.body
+        self.send_response(200)
+        self.send_header("Content-Type", rendered.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", rendered.etag)
+        self.send_header("Vary", "Accept, Accept-Encoding")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def start_http_server(port: int, cache: Optional[ExpositionCache] = None, addr: str = "") -> ThreadingHTTPServer:
+    """Drop-in replacement for prometheus_client.start_http_server serving from an ExpositionCache."""
+    handler = type("CachedMetricsHandler", (MetricsHandler,), {"cache": cache or ExpositionCache()})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,87 @@
+"""Self-instrumentation shared by the exporters, exported under the exporter_* namespace.
+
+Instrumentation is disabled until enable() is called.  Until then every helper returns immediately (phase() hands back
+a shared no-op context manager), so instrumented code paths only pay for a function call and a None check.
+"""
+
+import contextlib
+from time import perf_counter
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
+
+_metrics = None
+_DISABLED = contextlib.nullcontext()
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram) -> None:
+        self._histogram = histogram
+
+    def __enter__(self) -> None:
+        self._start = perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(perf_counter() - self._start)
+
+
+def enable(registry: CollectorRegistry = REGISTRY) -> None:
+    global _metrics
+    if _metrics is not None:
+        return
+
+    _metrics = {
+        "phase": Histogram(
+            "exporter_phase_duration_seconds", "Duration of each phase of a collection cycle", ["exporter", "phase"], registry=registry
+        ),
+        "pool": Histogram(
+            "exporter_pool_duration_seconds", "Duration of refreshing and collecting each pool", ["pool", "coin", "phase"], registry=registry
+        ),
+        "request_duration": Histogram(
+            "exporter_upstream_request_duration_seconds", "Latency of pool API requests", ["pool", "endpoint"], registry=registry
+        ),
+        "requests": Counter("exporter_upstream_requests", "Pool API requests by HTTP status", ["pool", "endpoint", "status"], registry=registry),
+        "response_bytes": Counter("exporter_upstream_response_bytes", "Bytes received from pool APIs", ["pool", "endpoint"], registry=registry),
+        "cache": Counter(
+            "exporter_upstream_cache_requests", "Pool API requests answered from the response cache (hit) or upstream (miss)",
+            ["pool", "endpoint", "result"], registry=registry
+        ),
+    }
+
+
+def enabled() -> bool:
+    return _metrics is not None
+
+
+def phase(exporter: str, name: str):
+    """Context manager timing one phase of a collection cycle."""
+    if _metrics is None:
+        return _DISABLED
+
+    return _Timer(_metrics["phase"].labels(exporter, name))
+
+
+def pool_phase(pool: str, coin: str, name: str):
+    """Context manager timing the refresh or collection of a single pool."""
+    if _metrics is None:
+        return _DISABLED
+
+    return _Timer(_metrics["pool"].labels(pool, coin, name))
+
+
+def observe_request(pool: str, endpoint: str, status, duration: float, size: int = 0) -> None:
+    if _metrics is None:
+        return
+
+    endpoint = endpoint or "/"
+    _metrics["request_duration"].labels(pool, endpoint).observe(duration)
+    _metrics["requests"].labels(pool, endpoint, str(status)).inc()
+    _metrics["response_bytes"].labels(pool, endpoint).inc(size)
+
+
+def observe_cache(pool: str, endpoint: str, hit: bool) -> None:
+    if _metrics is None:
+        return
+
+    _metrics["cache"].labels(pool, endpoint or "/", "hit" if hit else "miss").inc()
@@ -0,0 +1,214 @@
+"""Pushes metrics to a Pushgateway or a Prometheus remote write endpoint, for exporters Prometheus cannot scrape.
+
+Every batch is encoded and compressed once and sent right away.  Only while the endpoint cannot be reached are the
+batches written to a bounded on-disk spool (dropping the oldest once it is full), and sent in order once it is
+reachable again.
+
+Remote write requires python-snappy.  The Pushgateway keeps only the last pushed value of every series, so only
+remote write preserves the samples of the batches that were spooled while the link was down.
+"""
+
+import gzip
+import logging
+import logging.handlers
+import os
+import struct
+from typing import Iterable, List, Optional
+from urllib.parse import quote
+
+import requests
+from prometheus_client import Metric
+from prometheus_client.exposition import CONTENT_TYPE_LATEST, generate_latest
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class Spool:
+    """Bounded FIFO of encoded batches, one file per batch named after its sequence number."""
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self._directory = directory
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Sequence numbers of the spooled batches, oldest first, and their sizes.
+        self._batches = []
+        self._sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith(".batch"):
+                sequence = int(name[:-len(".batch")])
+                self._batches.append(sequence)
+                self._sizes[sequence] = os.path.getsize(self._path(sequence))
+            elif name.endswith(".tmp"):
+                os.unlink(os.path.join(directory, name))
+        self._batches.sort()
+        self._size = sum(self._sizes.values())
+        self._next = self._batches[-1] + 1 if self._batches else 0
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def append(self, body: bytes) -> None:
+        sequence = self._next
+        self._next += 1
+        temp_path = "{}.tmp".format(self._path(sequence))
+        with open(temp_path, "wb") as batch_file:
+            batch_file.write(body)
+        os.replace(temp_path, self._path(sequence))
+        self._batches.append(sequence)
+        self._sizes[sequence] = len(body)
+        self._size += len(body)
+
+        dropped = 0
+        while len(self._batches) > 1 and self._size > self._max_bytes:
+            self.pop()
+            dropped += 1
+        if dropped:
+            log.warning("Push spool {} is full.  Dropped the {} oldest batches.".format(self._directory, dropped))
+
+    def peek(self) -> Optional[bytes]:
+        if not self._batches:
+            return None
+
+        with open(self._path(self._batches[0]), "rb") as batch_file:
+            return batch_file.read()
+
+    def pop(self) -> None:
+        sequence = self._batches.pop(0)
+        self._size -= self._sizes.pop(sequence)
+        os.unlink(self._path(sequence))
+
+    def _path(self, sequence: int) -> str:
+        return os.path.join(self._directory, "{:020d}.batch".format(sequence))
+
+
+class PushgatewayTarget:
+    """PUTs gzipped text expositions to /metrics/job/<job>/instance/<instance> of a Pushgateway."""
+
+    name = "pushgateway"
+
+    def __init__(self, url: str, job: str, instance: str, timeout: float = 10) -> None:
+        self._url = "{}/metrics/job/{}/instance/{}".format(url.rstrip("/"), quote(job, safe=""), quote(instance, safe=""))
+        self._timeout = timeout
+        self._session = requests.Session()
+
+    def encode(self, families: List[Metric], timestamp: float) -> bytes:
+        # The Pushgateway rejects samples with timestamps, it records the push time itself.
+        return gzip.compress(generate_latest(_Families(families)))
+
+    def send(self, body: bytes) -> None:
+        headers = {"Content-Type": CONTENT_TYPE_LATEST, "Content-Encoding": "gzip"}
+        self._session.put(self._url, data=body, headers=headers, timeout=self._timeout).raise_for_status()
+
+
+class RemoteWriteTarget:
+    """POSTs snappy compressed protobuf WriteRequests to a Prometheus remote write endpoint."""
+
+    name = "remote_write"
+
+    def __init__(self, url: str, job: str, instance: str, timeout: float = 10) -> None:
+        if snappy is None:
+            raise RuntimeError("Pushing to a remote write endpoint requires python-snappy")
+
+        self._url = url
+        self._extra_labels = {"job": job, "instance": instance}
+        self._timeout = timeout
+        self._session = requests.Session()
+
+    def encode(self, families: List[Metric], timestamp: float) -> bytes:
+        timestamp_ms = int(timestamp * 1000)
+        request = bytearray()
+        for family in families:
+            for sample in family.samples:
+                labels = dict(self._extra_labels, **sample.labels)
+                labels["__name__"] = sample.name
+                series = bytearray()
+                for name in sorted(labels):
+                    series += _field(1, _field(1, name.encode()) + _field(2, str(labels[name]).encode()))
+                series += _field(2, b"\x09" + struct.pack("<d", sample.value) + b"\x10" + _varint(timestamp_ms))
+                request += _field(1, bytes(series))
+
+        return snappy.compress(bytes(request))
+
+    def send(self, body: bytes) -> None:
+        headers = {
+            "Content-Type": "application/x-protobuf",
+            "Content-Encoding": "snappy",
+            "X-Prometheus-Remote-Write-Version": "0.1.0",
+        }
+        self._session.post(self._url, data=body, headers=headers, timeout=self._timeout).raise_for_status()
+
+
+class Pusher:
+    def __init__(self, target, spool: Spool) -> None:
+        self._target = target
+        self._spool = spool
+
+    def push(self, families: List[Metric], timestamp: float) -> None:
+        body = self._target.encode(families, timestamp)
+        # While the endpoint is reachable batches never touch the disk.  They are only spooled when they cannot be sent
+        # right now, or to stay behind older batches that are still waiting.
+        if not len(self._spool):
+            if not self._send(body):
+                self._spool.append(body)
+            return
+
+        self._spool.append(body)
+        self.drain()
+
+    def drain(self) -> None:
+        """Sends the spooled batches oldest first, stopping at the first one that cannot be sent right now."""
+        while len(self._spool):
+            if not self._send(self._spool.peek()):
+                return
+            self._spool.pop()
+
+    def _send(self, body: bytes) -> bool:
+        """Sends one batch.  False if it should be sent again later, True once it was sent or can never be."""
+        try:
+            self._target.send(body)
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code
+            if status < 500 and status != 429:
+                # The endpoint will never accept this batch.  Drop it rather than blocking every later batch.
+                log.error("Dropping a batch rejected by the {} endpoint -> {}".format(self._target.name, str(e)))
+                return True
+            log.warning("Unable to push to the {} endpoint, {} batches spooled -> {}".format(self._target.name, len(self._spool), str(e)))
+            return False
+        except requests.exceptions.RequestException as e:
+            log.warning("Unable to push to the {} endpoint, {} batches spooled -> {}".format(self._target.name, len(self._spool), str(e)))
+            return False
+
+        return True
+
+
+class _Families:
+    """Minimal collector registry serving a fixed list of metric families to generate_latest()."""
+
+    def __init__(self, families: Iterable[Metric]) -> None:
+        self._families = families
+
+    def collect(self):
+        return iter(self._families)
+
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """A length-delimited protobuf field."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
@@ -0,0 +1,126 @@
+"""Cardinality controls shared by the exporters, configured with a YAML file (see etc/labels.yml).
+
+Metric families can be allowed or denied by name, and each family's labels can be dropped or have their values
+rewritten with a regular expression.  Family names are matched with shell-style wildcards (fnmatch) and are the
+names without the _total suffix of counters.  Series that become identical once labels are dropped are exported once
+(the first one wins), so dropping a label that tells series apart loses data rather than breaking the scrape.
+"""
+
+import fnmatch
+import functools
+import re
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence
+
+import yaml
+from prometheus_client import Metric
+
+# Rewritten values memoized per rewrite rule.
+REWRITE_CACHE_SIZE = 1024
+
+
+class LabelRules:
+    def __init__(self, config: dict = None) -> None:
+        config = config or {}
+        self._allow = list(config.get("allow") or ["*"])
+        self._deny = list(config.get("deny") or [])
+        self._drop = config.get("drop_labels") or {}
+        # family pattern -> label -> (compiled pattern, replacement)
+        self._rewrite = {
+            family: {label: (re.compile(rule["regex"]), rule["replacement"]) for label, rule in labels.items()}
+            for family, labels in (config.get("rewrite_labels") or {}).items()
+        }
+        # Computed once per family: name -> allowed, (name, label names) -> (kept label names, relabel function or None)
+        self._allowed = {}
+        self._families = {}
+
+    @classmethod
+    def load(cls, path: str) -> "LabelRules":
+        with open(path, "r") as config_file:
+            return cls(yaml.safe_load(config_file))
+
+    def allowed(self, name: str) -> bool:
+        if name not in self._allowed:
+            self._allowed[name] = self._matches(name, self._allow) and not self._matches(name, self._deny)
+        return self._allowed[name]
+
+    def labels(self, name: str, labels: Sequence[str]) -> List[str]:
+        """The names of the labels of family ``name`` that are kept."""
+        return self._family(name, labels)[0]
+
+    def relabeler(self, name: str, labels: Sequence[str]) -> Optional[Callable[[tuple], tuple]]:
+        """A function mapping label values (in ``labels`` order) to the kept, rewritten values.  None if nothing changes."""
+        return self._family(name, labels)[1]
+
+    def filter(self, families: Iterable[Metric]) -> Iterator[Metric]:
+        """Applies the rules to metric families built by a collector."""
+        for family in families:
+            if not self.allowed(family.name):
+                continue
+            if not family.samples:
+                yield family
+                continue
+
+            label_names = list(family.samples[0].labels)
+            kept = self.labels(family.name, label_names)
+            relabel = self.relabeler(family.name, label_names)
+            if relabel is None:
+                yield family
+                continue
+
+            relabeled = Metric(family.name, family.documentation, family.type, family.unit)
+            seen = set()
+            for sample in family.samples:
+                values = relabel(tuple(sample.labels[label] for label in label_names))
+                key = (sample.name, values)
+                if key in seen:
+                    continue
+                seen.add(key)
+                relabeled.samples.append(sample._replace(labels=dict(zip(kept, values))))
+            yield relabeled
+
+    def _family(self, name: str, labels: Sequence[str]) -> tuple:
+        key = (name, tuple(labels))
+        if key not in self._families:
+            dropped = set()
+            for pattern, drop_labels in self._drop.items():
+                if fnmatch.fnmatchcase(name, pattern):
+                    dropped.update(drop_labels)
+
+            rewrites = {}
+            for pattern, label_rules in self._rewrite.items():
+                if fnmatch.fnmatchcase(name, pattern):
+                    for label, rule in label_rules.items():
+                        rewrites.setdefault(label, rule)
+
+            kept = [label for label in labels if label not in dropped]
+            indexes = [index for index, label in enumerate(labels) if label not in dropped]
+            kept_rewrites = [(position, rewrites[label]) for position, label in enumerate(kept) if label in rewrites]
+            relabel = None
+            if len(kept) != len(labels) or kept_rewrites:
+                relabel = _relabeler(indexes, kept_rewrites)
+            self._families[key] = (kept, relabel)
+        return self._families[key]
+
+    @staticmethod
+    def _matches(name: str, patterns: List[str]) -> bool:
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def _relabeler(indexes: List[int], rewrites: list) -> Callable[[tuple], tuple]:
+    # Label values repeat on every cycle, so the rewritten values are memoized.  The memo is bounded, as values such as
+    # miner_version or worker names churn over the life of the process.
+    rewriters = [
+        (position, functools.lru_cache(maxsize=REWRITE_CACHE_SIZE)(_rewriter(regex, replacement))) for position, (regex, replacement) in rewrites
+    ]
+
+    def relabel(values: tuple) -> tuple:
+        values = [values[index] for index in indexes]
+        for position, rewrite in rewriters:
+            values[position] = rewrite(values[position])
+        return tuple(values)
+
+    return relabel
+
+
+def _rewriter(regex, replacement: str) -> Callable[[Any], str]:
+    return lambda value: regex.sub(replacement, str(value))
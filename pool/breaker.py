@@ -0,0 +1,64 @@
+import random
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Per-pool circuit breaker with exponential backoff and jitter.
+
+    The circuit opens after a failed refresh.  While it is open no requests are made to the pool API.  Once the backoff
+    has elapsed the circuit becomes half-open and lets exactly one probe through.  A successful probe closes the
+    circuit, a failed one re-opens it with twice the previous backoff (capped at ``max_backoff``).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def failures(self) -> int:
+        return self._failures
+
+    @property
+    def retry_at(self) -> float:
+        """time.monotonic() at which the next probe will be allowed.  0 when the circuit is closed."""
+        return self._retry_at
+
+    def __init__(self, backoff: float = 60, max_backoff: float = 3600) -> None:
+        self._backoff = float(backoff)
+        self._max_backoff = float(max_backoff)
+        self._state = self.CLOSED
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            elif self._state == self.OPEN and time.monotonic() >= self._retry_at:
+                self._state = self.HALF_OPEN
+                return True
+
+            # Either still backing off, or the single half-open probe is already outstanding.
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._retry_at = 0.0
+
+    def record_failure(self) -> float:
+        with self._lock:
+            self._failures += 1
+            delay = min(self._max_backoff, self._backoff * 2 ** (self._failures - 1))
+            # "Equal jitter" keeps at least half of the backoff, so pools that failed together do not retry together.
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            self._state = self.OPEN
+            self._retry_at = time.monotonic() + delay
+            return delay
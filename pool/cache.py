@@ -0,0 +1,66 @@
+import hashlib
+import logging
+import logging.handlers
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class ResponseCache:
+    """Size-bounded, SQLite backed cache of raw pool API responses.
+
+    With a file path the cache survives restarts, so a restarted exporter does not hit every pool API at once.  Entries
+    are keyed on a hash of the request URL (URLs can contain API keys).  Once the stored bodies exceed max_bytes, expired
+    entries are dropped first and then the oldest ones.
+    """
+
+    def __init__(self, path: str = ":memory:", max_bytes: int = 16 * 1024 * 1024) -> None:
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body BLOB NOT NULL, stored REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)")
+
+    def get(self, url: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute("SELECT body FROM responses WHERE key = ? AND expires > ?", (self._key(url), time.time())).fetchone()
+
+        return row[0] if row else None
+
+    def set(self, url: str, body: bytes, ttl: float) -> None:
+        if ttl <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._db.execute("REPLACE INTO responses (key, body, stored, expires) VALUES (?, ?, ?, ?)", (self._key(url), body, now, now + ttl))
+            self._evict(now)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _evict(self, now: float) -> None:
+        size = self._db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        if size <= self._max_bytes:
+            return
+
+        self._db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        size = self._db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        for key, length in self._db.execute("SELECT key, LENGTH(body) FROM responses ORDER BY stored").fetchall():
+            if size <= self._max_bytes:
+                break
+            log.debug("Evicting cached pool API response {}".format(key))
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            size -= length
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
@@ -4,61 +4,71 @@ from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
 
 
 class hiveon(Pool):
+    _endpoints = ("", "/workers", "/billing-acc")
+    _cache_ttl = {"/billing-acc": 300}
+    # Can be overridden per instance with base_url, e.g. to point at a test server.
+    base_url = "https://hiveon.net/api/v1"
 
     @property
     def pool_hashrate(self):
-        data = self._call()
+        data = self._data()
         return data["hashrate"], None
 
     @property
     def pool_balance(self):
-        data = self._call("/billing-acc")
+        data = self._data("/billing-acc")
         return data["totalUnpaid"], None
 
     @property
     def worker_hashrates(self):
-        data = self._call("/workers")
+        data = self._data("/workers")
         for worker_name, worker_info in data["workers"].items():
             yield worker_name, worker_info.get("hashrate", 0), None
 
     @property
     def pool_ratio(self):
-        data = self._call()
+        data = self._data()
         timestamp = self._convert_timestamp_to_epoch(data["sharesStatusStats"]["lastShareDt"])
         yield "accepted", data["sharesStatusStats"]["validCount"], timestamp
         yield "rejected", data["sharesStatusStats"]["staleCount"], timestamp
 
     @property
     def worker_ratios(self):
-        data = self._call("/workers")
+        data = self._data("/workers")
         for worker_name, worker_info in data["workers"].items():
             timestamp = self._convert_timestamp_to_epoch(worker_info["sharesStatusStats"]["lastShareDt"])
             yield worker_name, "accepted", worker_info["sharesStatusStats"]["validCount"], timestamp
             yield worker_name, "rejected", worker_info["sharesStatusStats"]["staleCount"], timestamp
 
     @property
-    def pool_rewards(self):
-        data = self._call("/billing-acc")
+    def reward_events(self):
+        data = self._data("/billing-acc")
 
         for earned in data["earningStats"]:
-            yield earned["reward"], self._convert_timestamp_to_epoch(earned["timestamp"])
+            yield earned["reward"], earned["timestamp"]
 
     @property
-    def pool_payouts(self):
-        data = self._call("/billing-acc")
+    def payout_events(self):
+        data = self._data("/billing-acc")
         if data["succeedPayouts"]:
             for index in data["succeedPayouts"]:
-                yield index["amount"], self._convert_timestamp_to_epoch(index["createdAt"], "%Y-%m-%dT%H:%M:%S.%fZ")
+                yield index["amount"], index["createdAt"]
 
-    def __init__(self, wallet: str, coin: str, **kwargs) -> None:
+    def __init__(self, wallet: str, coin: str, base_url: str = None, **kwargs) -> None:
         # Remove the "0x" on the fly if the user included it
         if wallet.startswith("0x"):
             wallet = wallet[2:]
 
         wallet = wallet.lower()
         coin = coin.upper()
-        endpoint = "https://hiveon.net/api/v1/stats/miner/{wallet}/{coin}".format(wallet=wallet, coin=coin)
-        super().__init__(base_endpoint=endpoint, wallet=wallet, coin=coin, pool_name="hiveon.net")
+        endpoint = "{base_url}/stats/miner/{wallet}/{coin}".format(base_url=(base_url or self.base_url).rstrip("/"), wallet=wallet, coin=coin)
+        super().__init__(base_endpoint=endpoint, wallet=wallet, coin=coin, pool_name="hiveon.net", **kwargs)
+
+    def _event_epoch(self, timestamp_str) -> float:
+        # Payout timestamps include milliseconds, reward timestamps do not.
+        if "." in timestamp_str:
+            return self._convert_timestamp_to_epoch(timestamp_str, "%Y-%m-%dT%H:%M:%S.%fZ")
+        return self._convert_timestamp_to_epoch(timestamp_str)
 
     def _convert_timestamp_to_epoch(self, timestamp_str, format="%Y-%m-%dT%H:%M:%SZ") -> float:
         converted_time = datetime.datetime.strptime(timestamp_str, format)
@@ -1,17 +1,158 @@
-from typing import Any
+import copy
+import hashlib
+import json
+import time
+from types import MappingProxyType
+from typing import Any, Callable, Iterable, Optional, Tuple
 from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
 import requests
-import requests_cache
+from exporter import instrumentation
+from .breaker import CircuitBreaker
+from .cache import ResponseCache
+from .transport import Transport
+from .transport import shared as shared_transport
 import ssl
 import logging
 import logging.handlers
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
-requests_cache.install_cache(backend="memory", expire_after=60)
+
+
+class PoolSnapshot:
+    """Immutable set of metric values derived from a single pool refresh."""
+
+    __slots__ = (
+        "wallet",
+        "coin",
+        "pool",
+        "timestamp",
+        "pool_hashrate",
+        "pool_ratio",
+        "worker_hashrates",
+        "worker_ratios",
+        "pool_balance",
+        "pool_rewards",
+        "pool_payouts",
+    )
+
+    def __init__(self, pool: "Pool", timestamp: float, rewards: "EventLedger", payouts: "EventLedger") -> None:
+        values = {
+            "wallet": pool.wallet,
+            "coin": pool.coin,
+            "pool": pool.pool,
+            "timestamp": timestamp,
+            "pool_hashrate": pool.pool_hashrate,
+            "pool_ratio": tuple(pool.pool_ratio),
+            "worker_hashrates": tuple(pool.worker_hashrates),
+            "worker_ratios": tuple(pool.worker_ratios),
+            "pool_balance": pool.pool_balance,
+            "pool_rewards": rewards.summary,
+            "pool_payouts": payouts.summary,
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value) -> None:
+        raise AttributeError("PoolSnapshot is immutable")
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.timestamp
+
+    def refreshed(self, timestamp: float) -> "PoolSnapshot":
+        """A copy of this snapshot taken at ``timestamp``, for refreshes that found the pool data unchanged."""
+        snapshot = object.__new__(PoolSnapshot)
+        for name in self.__slots__:
+            object.__setattr__(snapshot, name, getattr(self, name))
+        object.__setattr__(snapshot, "timestamp", timestamp)
+        return snapshot
+
+
+class EndpointState:
+    """What is known about one pool API endpoint: its validators, the digest of its last body and its poll interval.
+
+    Endpoints whose data did not change when polled are polled half as often, up to max_interval.  As soon as their
+    data changes they are polled every min_interval again.
+    """
+
+    __slots__ = ("etag", "last_modified", "digest", "data", "interval", "next_poll", "_min_interval", "_max_interval")
+
+    def __init__(self, min_interval: float, max_interval: float) -> None:
+        self.etag = None
+        self.last_modified = None
+        self.digest = None
+        self.data = None
+        self.interval = min_interval
+        self.next_poll = 0.0
+        self._min_interval = min_interval
+        self._max_interval = max(min_interval, max_interval)
+
+    def validators(self) -> dict:
+        # A 304 hands back the data decoded from the last good body, so there is nothing to validate without it.
+        headers = {}
+        if self.data is None:
+            return headers
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def polled(self, changed: bool) -> None:
+        self.interval = self._min_interval if changed else min(self.interval * 2, self._max_interval)
+        # Polled a little early so the endpoint is due on the pool refresh following the interval.
+        self.next_poll = time.monotonic() + self.interval - self._min_interval / 2
+
+
+class EventLedger:
+    """Running totals of a pool's reward or payout history.
+
+    Pool APIs return a window of their history on every call.  Only the events newer than the high-water mark are
+    processed, so the cost of a refresh does not grow with the history.  Event timestamps are compared as the raw
+    strings the APIs return (which sort chronologically), so old events are skipped without being parsed.
+    """
+
+    @property
+    def summary(self) -> Tuple[float, Optional[float], Optional[float]]:
+        """(cumulative amount, amount of the newest event, epoch timestamp of the newest event)"""
+        return self.total, self.last_amount, self.last_timestamp
+
+    def __init__(self) -> None:
+        self.total = 0.0
+        self.last_amount = None
+        self.last_timestamp = None
+        self._mark = None
+        # Events already counted that share the high-water mark's timestamp.
+        self._seen_at_mark = frozenset()
+
+    def ingest(self, events: Iterable[Tuple[float, str]], to_epoch: Callable[[str], float]) -> None:
+        mark = self._mark
+        newest, newest_seen = mark, set(self._seen_at_mark)
+        for amount, timestamp_str in events:
+            if mark is not None and (timestamp_str < mark or (timestamp_str == mark and (amount, timestamp_str) in self._seen_at_mark)):
+                continue
+
+            self.total += float(amount)
+            if newest is None or timestamp_str > newest:
+                newest, newest_seen = timestamp_str, {(amount, timestamp_str)}
+                self.last_amount = float(amount)
+            elif timestamp_str == newest:
+                newest_seen.add((amount, timestamp_str))
+
+        if newest != mark:
+            self.last_timestamp = to_epoch(newest)
+        self._mark, self._seen_at_mark = newest, frozenset(newest_seen)
 
 
 class Pool:
+    # URIs (relative to the base endpoint) that the metric properties read from.
+    # Every URI is fetched exactly once per refresh.
+    _endpoints = ("",)
+    # Default response cache TTLs (in seconds) for slow moving endpoints.  Every other endpoint is cached for one
+    # refresh_interval.  Both can be overridden per pool instance with the cache_ttl parameter.
+    _cache_ttl = {}
+
     @property
     def wallet(self) -> str:
         if not self._wallet:
@@ -33,11 +174,115 @@ class Pool:
 
         return self._pool
 
-    def __init__(self, base_endpoint: str, wallet: str = None, coin: str = None, pool_name: str = None) -> None:
+    @property
+    def poll_intervals(self) -> dict:
+        """Current poll interval of every endpoint, in seconds."""
+        return {uri: state.interval for uri, state in self._endpoint_state.items()}
+
+    @property
+    def snapshot(self) -> Optional[PoolSnapshot]:
+        """The last successfully refreshed snapshot, or None if no refresh has succeeded yet."""
+        return self._snapshot
+
+    def __init__(
+        self,
+        base_endpoint: str,
+        wallet: str = None,
+        coin: str = None,
+        pool_name: str = None,
+        refresh_interval: float = 60,
+        timeout: float = 30,
+        request_timeout: float = 10,
+        backoff: float = None,
+        max_backoff: float = 3600,
+        cache: ResponseCache = None,
+        cache_ttl=None,
+        transport: Transport = None,
+        max_refresh_interval: float = None,
+    ) -> None:
         self._base_url = base_endpoint
         self._coin = coin
         self._wallet = wallet
         self._pool = pool_name
+        self.refresh_interval = float(refresh_interval)
+        if self.refresh_interval <= 0:
+            raise ValueError("refresh_interval of {} for coin {} must be greater than 0, not {}".format(pool_name, coin, refresh_interval))
+        # timeout bounds a whole refresh of the pool, request_timeout bounds each individual API call.
+        self.timeout = float(timeout)
+        self.request_timeout = float(request_timeout)
+        # Failed refreshes back off starting at one refresh interval unless configured otherwise.
+        self.breaker = CircuitBreaker(backoff=backoff or self.refresh_interval, max_backoff=max_backoff)
+        self._responses = MappingProxyType({})
+        # The responses the metric properties read while a refresh derives its snapshot from them.
+        self._pending = None
+        self._snapshot = None
+        self._cache = cache
+        # Connections are shared with every other pool instance talking to the same host.
+        self._transport = transport or shared_transport()
+        self.rewards = EventLedger()
+        self.payouts = EventLedger()
+        # cache_ttl is either a single TTL for every endpoint, or a mapping of endpoint -> TTL.
+        self._endpoint_ttl = dict(self._cache_ttl)
+        if isinstance(cache_ttl, dict):
+            self._endpoint_ttl.update(cache_ttl)
+        elif cache_ttl is not None:
+            self._endpoint_ttl = {uri: cache_ttl for uri in self._endpoints}
+        # Endpoints whose data does not change are polled less often, down to once every max_refresh_interval.
+        max_refresh_interval = float(max_refresh_interval or 4 * self.refresh_interval)
+        self._endpoint_state = {uri: EndpointState(float(self.refresh_interval), max_refresh_interval) for uri in self._endpoints}
+
+    def refresh(self) -> PoolSnapshot:
+        responses = {}
+        deadline = time.monotonic() + self.timeout
+        for uri in self._endpoints:
+            if uri in self._responses and time.monotonic() < self._endpoint_state[uri].next_poll:
+                responses[uri] = self._responses[uri]
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Refreshing {} for coin {} took longer than {}s".format(self._pool, self._coin, self.timeout))
+            responses[uri] = self._call(uri, timeout=min(self.request_timeout, remaining))
+
+        # Unchanged endpoints hand back the very same decoded data, so nothing needs to be derived again.
+        if self._snapshot and all(responses[uri] is self._responses.get(uri) for uri in self._endpoints):
+            self._snapshot = self._snapshot.refreshed(time.time())
+            return self._snapshot
+
+        # The responses and ledgers are only replaced once the snapshot is derived.  A refresh that fails leaves them
+        # untouched, so the next refresh of the same data derives the snapshot again instead of re-stamping the last one.
+        rewards, payouts = copy.copy(self.rewards), copy.copy(self.payouts)
+        pending = self._pending = MappingProxyType(responses)
+        try:
+            rewards.ingest(self.reward_events, self._event_epoch)
+            payouts.ingest(self.payout_events, self._event_epoch)
+            snapshot = PoolSnapshot(self, time.time(), rewards, payouts)
+        finally:
+            self._pending = None
+
+        self._responses, self.rewards, self.payouts = pending, rewards, payouts
+        self._snapshot = snapshot
+        return self._snapshot
+
+    def _data(self, uri: str = "") -> Any:
+        return (self._responses if self._pending is None else self._pending)[uri]
+
+    def _extract(self, uri: str, data: Any) -> Any:
+        """The part of a decoded API response that the metric properties read."""
+        return data
+
+    @property
+    def reward_events(self) -> Iterable[Tuple[float, str]]:
+        """Every reward in the API response as (amount, timestamp string)."""
+        raise NotImplementedError
+
+    @property
+    def payout_events(self) -> Iterable[Tuple[float, str]]:
+        """Every payout in the API response as (amount, timestamp string)."""
+        raise NotImplementedError
+
+    def _event_epoch(self, timestamp_str: str) -> float:
+        raise NotImplementedError
 
     def set_metrics(
         self,
@@ -64,21 +309,59 @@ class Pool:
         raise NotImplementedError
 
     def _call(self, uri: str = "", **kwargs) -> Any:
-        if not getattr(self, "_api", None):
-            self._api = requests.Session()
-
+        kwargs.setdefault("timeout", self.request_timeout)
         full_url = "{}{}".format(self._base_url, uri)
+        state = self._endpoint_state[uri]
+        if self._cache:
+            cached = self._cache.get(full_url)
+            instrumentation.observe_cache(self._pool, uri, cached is not None)
+            if cached is not None:
+                # A cached body says nothing about how often the endpoint changes, so the poll interval is kept.
+                return self._decode(uri, cached)
+
+        kwargs["headers"] = dict(kwargs.get("headers") or {}, **state.validators())
+        start = time.perf_counter()
         try:
-            response = self._api.get(full_url, **kwargs)
+            response = self._transport.get(full_url, **kwargs)
+            instrumentation.observe_request(self._pool, uri, response.status_code, time.perf_counter() - start, len(response.content))
             response.raise_for_status()
         except ssl.SSLCertVerificationError as e:
             log.warn('SSL Cert error calling {} -> {}'.format(full_url, str(e)))
-        except Exception:
-            # Add more intelligent handling
+            instrumentation.observe_request(self._pool, uri, "error", time.perf_counter() - start)
+            raise
+        except requests.exceptions.HTTPError:
             raise
-
-        try:
-            return response.json()
         except Exception:
             # Add more intelligent handling
+            instrumentation.observe_request(self._pool, uri, "error", time.perf_counter() - start)
             raise
+
+        if response.status_code == 304:
+            if state.data is None:
+                state.etag = state.last_modified = None
+                raise requests.exceptions.HTTPError("304 Not Modified without a previous response for url: {}".format(full_url), response=response)
+            state.polled(changed=False)
+            return state.data
+
+        previous = state.data
+        data = self._decode(uri, response.content)
+        # Only the validators of a body that decoded are kept, so a 304 always refers to the data in state.data.
+        state.etag = response.headers.get("ETag")
+        state.last_modified = response.headers.get("Last-Modified")
+        state.polled(changed=data is not previous)
+
+        if self._cache:
+            self._cache.set(full_url, response.content, self._endpoint_ttl.get(uri, self.refresh_interval))
+        return data
+
+    def _decode(self, uri: str, body: bytes) -> Any:
+        """Decodes a response body, or returns the previously decoded data if the body has not changed."""
+        state = self._endpoint_state[uri]
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if digest == state.digest and state.data is not None:
+            return state.data
+
+        data = self._extract(uri, json.loads(body))
+        state.digest = digest
+        state.data = data
+        return data
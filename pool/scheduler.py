@@ -0,0 +1,150 @@
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import logging.handlers
+import threading
+import time
+from typing import Iterable
+
+from exporter import instrumentation
+from .pool import Pool
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class RefreshScheduler:
+    """Refreshes every pool in the background, each on its own refresh_interval.
+
+    Pools that are due at the same time are refreshed concurrently on a bounded thread pool.  The scheduler waits at most
+    ``deadline`` seconds for a round of refreshes.  A pool that misses the deadline keeps serving its last good snapshot
+    and is not refreshed again until its outstanding refresh has finished.  Failing pools are skipped until their
+    circuit breaker lets a probe through.
+
+    The pools can be replaced while the scheduler runs with update().  Pools that were already scheduled keep their
+    place in the schedule, new ones are refreshed immediately.
+    """
+
+    def __init__(self, pools: Iterable[Pool], max_workers: int = 8, deadline: float = 60) -> None:
+        self._pools = list(pools)
+        self._max_workers = max_workers
+        self._deadline = deadline
+        self._in_flight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever a refresh finished or the pools were replaced, i.e. whenever the collected data may differ."""
+        return self._generation
+
+    def start(self) -> None:
+        if self._thread:
+            return
+
+        self._stop.clear()
+        self._wake.set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="pool-refresh")
+        self._thread = threading.Thread(target=self._run, name="pool-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def update(self, pools: Iterable[Pool]) -> None:
+        with self._lock:
+            self._pools = list(pools)
+            self._generation += 1
+        self._wake.set()
+
+    def _run(self) -> None:
+        # Entries are (next refresh as time.monotonic(), tie breaker, pool).  Every pool is due immediately when it is
+        # first scheduled.
+        queue = []
+        scheduled = set()
+        counter = itertools.count()
+        while not self._stop.is_set():
+            if self._wake.is_set():
+                self._wake.clear()
+                with self._lock:
+                    pools = self._pools
+                if set(pools) != scheduled:
+                    queue, scheduled = self._reschedule(queue, pools, counter)
+
+            wait = queue[0][0] - time.monotonic() if queue else None
+            if wait is None or wait > 0:
+                self._wake.wait(wait)
+                continue
+
+            due = []
+            while queue and queue[0][0] <= time.monotonic():
+                due.append(heapq.heappop(queue)[1:])
+
+            self._refresh_round(due)
+            for index, cur_pool in due:
+                # A pool whose circuit is open is not looked at again until its backoff has elapsed.
+                next_refresh = max(time.monotonic() + cur_pool.refresh_interval, cur_pool.breaker.retry_at)
+                heapq.heappush(queue, (next_refresh, index, cur_pool))
+
+    @staticmethod
+    def _reschedule(queue: list, pools: list, counter) -> tuple:
+        """Drops pools that were removed from the schedule and makes newly added pools due immediately."""
+        current = set(pools)
+        queue = [entry for entry in queue if entry[2] in current]
+        queued = {entry[2] for entry in queue}
+        queue.extend((0.0, next(counter), cur_pool) for cur_pool in pools if cur_pool not in queued)
+        heapq.heapify(queue)
+        return queue, current
+
+    def _refresh_round(self, due: list) -> None:
+        futures = {}
+        for _, cur_pool in due:
+            if cur_pool in self._in_flight:
+                log.warning('Skipping refresh of pool "{}" for coin {}.  The previous refresh is still running.'.format(cur_pool.pool, cur_pool.coin))
+                continue
+            elif not cur_pool.breaker.allow():
+                log.debug('Skipping refresh of pool "{}" for coin {}.  The circuit is {}.'.format(cur_pool.pool, cur_pool.coin, cur_pool.breaker.state))
+                continue
+
+            future = self._executor.submit(self._refresh, cur_pool)
+            self._in_flight[cur_pool] = future
+            future.add_done_callback(lambda _, cur_pool=cur_pool: self._in_flight.pop(cur_pool, None))
+            futures[future] = cur_pool
+
+        if not futures:
+            return
+
+        _, not_done = concurrent.futures.wait(futures, timeout=self._deadline)
+        for future in not_done:
+            cur_pool = futures[future]
+            log.warning('Refresh of pool "{}" for coin {} did not finish within {}s.'.format(cur_pool.pool, cur_pool.coin, self._deadline))
+
+    def _refresh(self, cur_pool: Pool) -> None:
+        log.debug('Refreshing pool "{}" for coin {}'.format(cur_pool.pool, cur_pool.coin))
+        try:
+            with instrumentation.pool_phase(cur_pool.pool, cur_pool.coin, "refresh"):
+                cur_pool.refresh()
+        except Exception as e:
+            delay = cur_pool.breaker.record_failure()
+            log.error(
+                'Failed to refresh pool "{}" for coin {}.  Serving the last good data and retrying in {:.0f}s -> {}'.format(
+                    cur_pool.pool, cur_pool.coin, delay, str(e)
+                )
+            )
+        else:
+            cur_pool.breaker.record_success()
+        finally:
+            with self._lock:
+                self._generation += 1
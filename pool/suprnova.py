@@ -9,82 +9,100 @@ import datetime
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# The warning about disabled TLS verification is only logged for the first instance.
+_warned_insecure = False
+
 
 class suprnova(Pool):
+    _endpoints = ("action=getuserstatus", "action=getuserbalance", "action=getuserworkers", "action=getusertransactions")
+    _cache_ttl = {"action=getuserbalance": 300, "action=getusertransactions": 300}
+    # Can be overridden per instance with base_url, e.g. to point at a test server.  {coin} is replaced by the coin.
+    base_url = "https://{coin}.suprnova.cc"
+
     @property
     def wallet(self):
         if not getattr(self, "_wallet", None):
-            data = self._call("action=getuserstatus")
+            data = self._data("action=getuserstatus")
             self._wallet = data["username"]
 
         return self._wallet
 
     @property
     def pool_hashrate(self):
-        data = self._call("action=getuserstatus")
+        data = self._data("action=getuserstatus")
         return data["hashrate"] * 1000, None
 
     @property
     def pool_balance(self):
-        data = self._call("action=getuserbalance")
+        data = self._data("action=getuserbalance")
         return data["confirmed"] + data["unconfirmed"], None
 
     @property
     def worker_hashrates(self):
-        data = self._call("action=getuserworkers")
+        data = self._data("action=getuserworkers")
         for worker_info in data:
             # In case the worker name somehow includes a "."
             yield self._get_worker_name(worker_info["username"]), worker_info["hashrate"] * 1000, None
 
     @property
     def pool_ratio(self):
-        data = self._call("action=getuserstatus")
+        data = self._data("action=getuserstatus")
         yield "accepted", data["shares"]["valid"], None
         yield "rejected", data["shares"]["invalid"], None
 
     @property
     def worker_ratios(self):
         # The Suprnova API does not provide information on worker invalid shares
-        data = self._call("action=getuserworkers")
+        data = self._data("action=getuserworkers")
         for worker_info in data:
             worker_name = self._get_worker_name(worker_info["username"])
             yield worker_name, "accepted", worker_info["shares"], None
 
     @property
-    def pool_rewards(self):
-        data = self._call("action=getusertransactions")
+    def reward_events(self):
+        data = self._data("action=getusertransactions")
         for cur_trx in data["transactions"]:
             if cur_trx["type"] == "Credit":
-                yield cur_trx["amount"], self._timestamp_to_epoch(cur_trx["timestamp"])
+                yield cur_trx["amount"], cur_trx["timestamp"]
 
     @property
-    def pool_payouts(self):
-        data = self._call("action=getusertransactions")
+    def payout_events(self):
+        data = self._data("action=getusertransactions")
         for cur_trx in data["transactions"]:
             if cur_trx["type"] == "Debit_AP":
-                yield cur_trx["amount"], self._timestamp_to_epoch(cur_trx["timestamp"])
+                yield cur_trx["amount"], cur_trx["timestamp"]
 
-    def __init__(self, api_key: str, coin: str, **kwargs) -> None:
+    def __init__(self, api_key: str, coin: str, verify_tls: bool = True, base_url: str = None, **kwargs) -> None:
+        global _warned_insecure
         self._coin = coin.upper()
-        endpoint = "https://{}.suprnova.cc/index.php?page=api&api_key={}&".format(self._coin.lower(), api_key)
-        super().__init__(base_endpoint=endpoint, coin=self._coin, pool_name="suprnova.cc")
+        self._verify_tls = verify_tls
+        if not verify_tls and not _warned_insecure:
+            _warned_insecure = True
+            log.warning("TLS certificate verification is disabled for suprnova (verify_tls: false).  Responses could be forged.")
+        base_url = (base_url or self.base_url).format(coin=self._coin.lower()).rstrip("/")
+        endpoint = "{}/index.php?page=api&api_key={}&".format(base_url, api_key)
+        super().__init__(base_endpoint=endpoint, coin=self._coin, pool_name="suprnova.cc", **kwargs)
 
     def _get_worker_name(self, username: str):
         # In case the worker name somehow includes a "."
         return ".".join(username.split(".")[1:])
 
+    def _event_epoch(self, timestamp_str) -> float:
+        return self._timestamp_to_epoch(timestamp_str)
+
     def _timestamp_to_epoch(self, timestamp_str, format="%Y-%m-%d %H:%M:%S") -> float:
         converted_time = datetime.datetime.strptime(timestamp_str, format)
         return converted_time.timestamp()
 
     def _call(self, uri: str = "", **kwargs) -> Any:
         try:
-            data = super()._call(uri, verify=False, **kwargs)
+            return super()._call(uri, verify=self._verify_tls, **kwargs)
         except requests.exceptions.HTTPError as e:
             if str(e).startswith("401 "):
                 log.error(
                     "Received HTTP 401 unauthorized talking to Supernova.  This means the API key is wrong, or too many HTTP requests have occurred."
                 )
-                raise
+            raise
 
+    def _extract(self, uri: str, data: Any) -> Any:
         return data[uri.replace("action=", "")]["data"]
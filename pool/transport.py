@@ -0,0 +1,126 @@
+import logging
+import logging.handlers
+import random
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class Transport:
+    """HTTP connections shared by every pool instance, pooled per upstream host.
+
+    Every host gets one requests.Session whose connections are kept alive between refreshes, so pool instances talking
+    to the same API share their TLS connections.  At most ``max_concurrency`` requests are in flight per host.  GET
+    requests that fail with a connection error, a timeout, HTTP 429 or a 5xx status are retried up to ``retries`` times
+    with full jitter backoff, as long as the retry still fits in the time the caller allowed for the request.
+    """
+
+    RETRY_STATUS = frozenset((429, 500, 502, 503, 504))
+
+    def __init__(
+        self,
+        pool_size: int = 4,
+        max_concurrency: int = 4,
+        connect_timeout: float = 5,
+        retries: int = 2,
+        retry_backoff: float = 1,
+        keep_alive: bool = True,
+    ) -> None:
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.keep_alive = keep_alive
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, timeout: float, **kwargs) -> requests.Response:
+        """GET url, spending at most roughly ``timeout`` seconds on it including retries.
+
+        The response of the last attempt is returned even if its status is an error, callers check it themselves.
+        """
+        session, slots = self._host(url)
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            try:
+                response = self._send(session, slots, url, deadline, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                delay = self._retry_delay(attempt, deadline)
+                if delay is None:
+                    raise
+                log.debug("Retrying {} in {:.1f}s -> {}".format(urlsplit(url).netloc, delay, str(e)))
+            else:
+                if response.status_code not in self.RETRY_STATUS:
+                    return response
+                delay = self._retry_delay(attempt, deadline, response.headers.get("Retry-After"))
+                if delay is None:
+                    return response
+                log.debug("Retrying {} in {:.1f}s -> HTTP {}".format(urlsplit(url).netloc, delay, response.status_code))
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, session: requests.Session, slots: threading.BoundedSemaphore, url: str, deadline: float, **kwargs) -> requests.Response:
+        # Time spent queued for one of the host's slots counts against the caller's budget as well.
+        if not slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise requests.exceptions.Timeout("No connection to {} became available in time".format(urlsplit(url).netloc))
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.exceptions.Timeout("No time left to request {}".format(urlsplit(url).netloc))
+            return session.get(url, timeout=(min(self.connect_timeout, remaining), remaining), **kwargs)
+        finally:
+            slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for session, _ in self._hosts.values():
+                session.close()
+            self._hosts = {}
+
+    def _host(self, url: str) -> tuple:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                if not self.keep_alive:
+                    session.headers["Connection"] = "close"
+                self._hosts[host] = (session, threading.BoundedSemaphore(self.max_concurrency))
+            return self._hosts[host]
+
+    def _retry_delay(self, attempt: int, deadline: float, retry_after: str = None) -> Optional[float]:
+        if attempt >= self.retries:
+            return None
+
+        delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        # Leave at least a second for the retry itself.
+        if time.monotonic() + delay + 1 >= deadline:
+            return None
+        return delay
+
+
+def shared() -> Transport:
+    """The transport used by pool instances that were not given one."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Transport()
+        return _shared
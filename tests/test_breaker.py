@@ -0,0 +1,38 @@
+import pathlib
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append("{}/../".format(pathlib.Path(__file__).parent.resolve()))
+from pool.breaker import CircuitBreaker  # noqa: E402
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_failure_opens_the_circuit_until_the_backoff_elapsed(self):
+        breaker = CircuitBreaker(backoff=10, max_backoff=100)
+        with mock.patch("pool.breaker.time.monotonic", return_value=1000.0):
+            delay = breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+
+        with mock.patch("pool.breaker.time.monotonic", return_value=1000.0 + delay):
+            self.assertTrue(breaker.allow())
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            # Only a single probe is let through.
+            self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.failures, 0)
+        self.assertTrue(breaker.allow())
+
+    def test_backoff_doubles_with_jitter_up_to_max_backoff(self):
+        breaker = CircuitBreaker(backoff=10, max_backoff=35)
+        for expected in (10, 20, 35, 35):
+            delay = breaker.record_failure()
+            self.assertGreaterEqual(delay, expected / 2)
+            self.assertLessEqual(delay, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
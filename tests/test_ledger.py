@@ -0,0 +1,33 @@
+import pathlib
+import sys
+import unittest
+
+sys.path.append("{}/../".format(pathlib.Path(__file__).parent.resolve()))
+from pool.pool import EventLedger  # noqa: E402
+
+
+class EventLedgerTest(unittest.TestCase):
+    @staticmethod
+    def to_epoch(timestamp_str: str) -> float:
+        return float(timestamp_str[-2:])
+
+    def test_only_new_events_are_counted(self):
+        ledger = EventLedger()
+        ledger.ingest([(1, "2024-01-01T00:00:01"), (2, "2024-01-01T00:00:02")], self.to_epoch)
+        self.assertEqual(ledger.summary, (3.0, 2.0, 2.0))
+
+        ledger.ingest([(1, "2024-01-01T00:00:01"), (2, "2024-01-01T00:00:02"), (4, "2024-01-01T00:00:03")], self.to_epoch)
+        self.assertEqual(ledger.summary, (7.0, 4.0, 3.0))
+
+    def test_new_events_sharing_the_newest_timestamp_are_counted(self):
+        ledger = EventLedger()
+        ledger.ingest([(1, "2024-01-01T00:00:05")], self.to_epoch)
+        ledger.ingest([(1, "2024-01-01T00:00:05"), (2, "2024-01-01T00:00:05")], self.to_epoch)
+        self.assertEqual(ledger.total, 3.0)
+
+        ledger.ingest([(1, "2024-01-01T00:00:05"), (2, "2024-01-01T00:00:05")], self.to_epoch)
+        self.assertEqual(ledger.total, 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import json
+import pathlib
+import sys
+import unittest
+
+import requests
+
+sys.path.append("{}/../".format(pathlib.Path(__file__).parent.resolve()))
+from pool.pool import EndpointState, Pool  # noqa: E402
+
+
+def make_response(status: int, body: bytes = b"", etag: str = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.url = "http://pool.test/"
+    if etag:
+        response.headers["ETag"] = etag
+    return response
+
+
+class StubTransport:
+    """Replies with queued responses and records the headers of every request."""
+
+    def __init__(self, *responses: requests.Response) -> None:
+        self.responses = list(responses)
+        self.headers = []
+
+    def get(self, url: str, timeout: float, headers: dict = None, **kwargs) -> requests.Response:
+        self.headers.append(headers or {})
+        return self.responses.pop(0)
+
+
+class StubPool(Pool):
+    def __init__(self, transport: StubTransport) -> None:
+        super().__init__(base_endpoint="http://pool.test/", wallet="wallet", coin="ETH", pool_name="stub", transport=transport)
+
+    def _extract(self, uri: str, data):
+        return data["data"]
+
+    @property
+    def pool_hashrate(self):
+        return self._data()["hashrate"], None
+
+    @property
+    def pool_ratio(self):
+        return []
+
+    @property
+    def worker_hashrates(self):
+        return []
+
+    @property
+    def worker_ratios(self):
+        return []
+
+    @property
+    def pool_balance(self):
+        return self._data()["balance"]
+
+    @property
+    def reward_events(self):
+        return [(reward["amount"], reward["time"]) for reward in self._data()["rewards"]]
+
+    @property
+    def payout_events(self):
+        return []
+
+    def _event_epoch(self, timestamp_str: str) -> float:
+        return float(timestamp_str)
+
+
+def body(value) -> bytes:
+    return json.dumps({"data": value}).encode()
+
+
+class ConditionalRequestTest(unittest.TestCase):
+    def test_not_modified_returns_the_previous_data(self):
+        transport = StubTransport(make_response(200, body({"hashrate": 1}), '"a"'), make_response(304, etag='"a"'))
+        pool = StubPool(transport)
+
+        first = pool._call()
+        self.assertIs(pool._call(), first)
+        self.assertEqual(transport.headers[1].get("If-None-Match"), '"a"')
+
+    def test_body_that_fails_to_decode_keeps_the_previous_validators(self):
+        transport = StubTransport(
+            make_response(200, body({"hashrate": 1}), '"a"'),
+            make_response(200, b'{"unexpected": 1}', '"b"'),
+            make_response(200, body({"hashrate": 2}), '"c"'),
+        )
+        pool = StubPool(transport)
+
+        pool._call()
+        with self.assertRaises(KeyError):
+            pool._call()
+        # A 304 to "b" would hand back the data of "a" as if it were current.
+        self.assertEqual(pool._call(), {"hashrate": 2})
+        self.assertEqual(transport.headers[2].get("If-None-Match"), '"a"')
+
+    def test_no_validators_are_sent_before_a_body_decoded(self):
+        transport = StubTransport(make_response(200, b"not json", '"a"'), make_response(200, body({"hashrate": 1}), '"a"'))
+        pool = StubPool(transport)
+
+        with self.assertRaises(ValueError):
+            pool._call()
+        self.assertEqual(pool._call(), {"hashrate": 1})
+        self.assertNotIn("If-None-Match", transport.headers[1])
+
+    def test_not_modified_without_data_is_an_error(self):
+        transport = StubTransport(make_response(304, etag='"a"'))
+        pool = StubPool(transport)
+        state = pool._endpoint_state[""]
+        state.etag = '"a"'
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            pool._call()
+        self.assertIsNone(state.etag)
+        self.assertIsNone(state.last_modified)
+
+
+class RefreshTest(unittest.TestCase):
+    def test_failed_refresh_does_not_restamp_the_previous_snapshot(self):
+        good = body({"hashrate": 1, "balance": 2, "rewards": [{"amount": 1, "time": "10"}]})
+        # Decodes fine, but has no balance to derive the snapshot from.
+        bad = body({"hashrate": 3, "rewards": [{"amount": 5, "time": "20"}]})
+        transport = StubTransport(make_response(200, good, '"a"'), make_response(200, bad, '"b"'), make_response(304, etag='"b"'))
+        pool = StubPool(transport)
+
+        first = pool.refresh()
+        pool._endpoint_state[""].next_poll = 0
+        with self.assertRaises(KeyError):
+            pool.refresh()
+        pool._endpoint_state[""].next_poll = 0
+        with self.assertRaises(KeyError):
+            pool.refresh()
+
+        self.assertIs(pool._snapshot, first)
+        self.assertEqual(pool.rewards.summary, (1.0, 1.0, 10.0))
+
+
+class EndpointStateTest(unittest.TestCase):
+    def test_unchanged_data_backs_off_up_to_max_interval(self):
+        state = EndpointState(10, 35)
+        intervals = []
+        for _ in range(4):
+            state.polled(changed=False)
+            intervals.append(state.interval)
+        self.assertEqual(intervals, [20, 35, 35, 35])
+
+        state.polled(changed=True)
+        self.assertEqual(state.interval, 10)
+
+    def test_validators_require_data(self):
+        state = EndpointState(10, 10)
+        state.etag = '"a"'
+        state.last_modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+        self.assertEqual(state.validators(), {})
+
+        state.data = {}
+        self.assertEqual(state.validators(), {"If-None-Match": '"a"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+
+if __name__ == "__main__":
+    unittest.main()
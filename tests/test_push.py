@@ -0,0 +1,112 @@
+import gzip
+import os
+import pathlib
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client.core import GaugeMetricFamily
+
+sys.path.append("{}/../".format(pathlib.Path(__file__).parent.resolve()))
+from exporter.push import Pusher, PushgatewayTarget, Spool  # noqa: E402
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Pushgateway stand-in: records the body of every accepted PUT and answers 503 while ``server.down`` is set."""
+
+    def do_PUT(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.down:
+            self.send_response(503)
+        else:
+            self.server.received.append(gzip.decompress(body).decode())
+            self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def families(value: float) -> list:
+    family = GaugeMetricFamily("test_value", "A test value", labels=["rig"])
+    family.add_metric(["rig1"], value)
+    return [family]
+
+
+def pushed_value(exposition: str) -> float:
+    return next(float(line.split(" ")[1]) for line in exposition.splitlines() if line.startswith("test_value{"))
+
+
+class PusherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.down = False
+        self.server.received = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.spool_dir = temp_dir.name
+        url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.pusher = Pusher(PushgatewayTarget(url, "hiveos", "rig1"), Spool(self.spool_dir))
+
+    def test_batches_are_not_spooled_while_the_endpoint_is_up(self):
+        self.pusher.push(families(1), 0)
+        self.assertEqual([pushed_value(body) for body in self.server.received], [1])
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_spooled_batches_are_drained_in_order_after_an_outage(self):
+        self.server.down = True
+        self.pusher.push(families(1), 0)
+        self.pusher.push(families(2), 0)
+        self.assertEqual(self.server.received, [])
+        self.assertEqual(len(os.listdir(self.spool_dir)), 2)
+
+        self.server.down = False
+        self.pusher.push(families(3), 0)
+        self.assertEqual([pushed_value(body) for body in self.server.received], [1, 2, 3])
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = temp_dir.name
+
+    def test_oldest_batches_are_dropped_at_max_bytes(self):
+        spool = Spool(self.directory, max_bytes=25)
+        for index in range(5):
+            spool.append("batch-{:04d}".format(index).encode())
+
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(spool.peek(), b"batch-0003")
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_leftover_batches_are_recovered_on_restart(self):
+        spool = Spool(self.directory)
+        spool.append(b"first")
+        spool.append(b"second")
+        # A batch that was being written when the exporter stopped.
+        with open(os.path.join(self.directory, "{:020d}.batch.tmp".format(2)), "wb") as partial:
+            partial.write(b"par")
+
+        spool = Spool(self.directory)
+        self.assertEqual(len(spool), 2)
+        self.assertFalse([name for name in os.listdir(self.directory) if name.endswith(".tmp")])
+        spool.append(b"third")
+
+        batches = []
+        while len(spool):
+            batches.append(spool.peek())
+            spool.pop()
+        self.assertEqual(batches, [b"first", b"second", b"third"])
+
+
+if __name__ == "__main__":
+    unittest.main()